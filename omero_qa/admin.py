@@ -22,7 +22,7 @@ from omero_qa.qa.models import FileFormat, TestFile, AppType, TracSystem, Trac,
         Feedback, FeedbackStatus, TestEngineResult, ImportSession, AdditionalFile, \
         JUnitResult, TestNGXML, TestFile2, MetadataTest, MetadataTestResult, \
         NotificationList
-from omero_qa.registry.models import Hit, Agent, IP, Continents, Version, DemoAccount
+from omero_qa.registry.models import Hit, HitHeader, HitDailyRollup, Agent, IP, Continents, Version, DemoAccount
 
 admin.site.register(EmailTemplate)
 
@@ -39,6 +39,8 @@ admin.site.register(ImportSession)
 admin.site.register(AdditionalFile)
 
 admin.site.register(Hit)
+admin.site.register(HitHeader)
+admin.site.register(HitDailyRollup)
 admin.site.register(IP)
 admin.site.register(Agent)
 admin.site.register(Continents)
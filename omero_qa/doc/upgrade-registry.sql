@@ -0,0 +1,27 @@
+--
+-- Registry schema changes which syncdb does not apply to existing
+-- tables (PostgreSQL). New tables are created by syncdb.
+--
+
+-- Compact request headers (registry_hitheader),
+-- then run: python manage.py compact_hit_headers
+ALTER TABLE "registry_hit" ADD COLUMN "headers_id" integer NULL
+    REFERENCES "registry_hitheader" ("id") DEFERRABLE INITIALLY DEFERRED;
+CREATE INDEX "registry_hit_headers_id" ON "registry_hit" ("headers_id");
+
+-- Daily rollups (registry_hitdailyrollup, registry_hitrollupstate),
+-- then run: python manage.py rollup_hits --rebuild
+CREATE INDEX "registry_hit_creation_date" ON "registry_hit" ("creation_date");
+
+-- Geohash of the addresses for the continent boxes,
+-- then run: python manage.py geohash_ips
+ALTER TABLE "registry_ip" ADD COLUMN "geohash" varchar(12) NULL;
+CREATE INDEX "registry_ip_geohash" ON "registry_ip" ("geohash");
+
+-- Test file and result counts of the statistics pages
+CREATE INDEX "qa_testfile_upload_date" ON "qa_testfile" ("upload_date");
+CREATE INDEX "qa_testengineresult_started" ON "qa_testengineresult" ("started");
+
+-- Location of the feedback addresses, set by the first view
+ALTER TABLE "qa_feedback" ADD COLUMN "latitude" double precision NULL;
+ALTER TABLE "qa_feedback" ADD COLUMN "longitude" double precision NULL;
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+''' Process-wide access to the GeoIP country and city databases.
+
+Opening a GeoIP database parses its structure and, for the city database,
+touches a file of several tens of megabytes. The readers below are opened
+once per worker process, lazily on first use, and re-opened when the .dat
+file is replaced on disk.'''
+
+import os
+import time
+import logging
+import threading
+
+from pygeoip import GeoIP, STANDARD, MMAP_CACHE
+
+from django.conf import settings
+
+logger = logging.getLogger('geolocation')
+
+
+class GeoIPDatabase(object):
+    """
+    Lazily opened, reloadable reader for a single GeoIP .dat file.
+
+    pygeoip readers keep a file position between seek() and read(), so
+    every lookup is serialised on the database lock.
+    """
+
+    def __init__(self, path, flags=MMAP_CACHE, check_interval=60):
+        self.path = path
+        self.flags = flags
+        self.check_interval = check_interval
+        self._reader = None
+        self._mtime = None
+        self._checked = 0
+        self._lock = threading.RLock()
+
+    def _open(self):
+        mtime = os.stat(self.path).st_mtime
+        self._reader = GeoIP(self.path, self.flags)
+        self._mtime = mtime
+        logger.info("GeoIP database '%s' opened in '%s'" % (self.path, os.getpid()))
+
+    def _reader_for_lookup(self):
+        now = time.time()
+        if self._reader is None:
+            self._open()
+            self._checked = now
+        elif now - self._checked >= self.check_interval:
+            self._checked = now
+            try:
+                if os.stat(self.path).st_mtime != self._mtime:
+                    logger.info("GeoIP database '%s' changed on disk, reloading" % self.path)
+                    self._open()
+            except (IOError, OSError):
+                # keep serving from the old reader while the file is
+                # being replaced
+                logger.error("GeoIP database '%s' could not be reloaded" % self.path)
+        return self._reader
+
+    def lookup(self, method, addr):
+        with self._lock:
+            return getattr(self._reader_for_lookup(), method)(addr)
+
+    def reload(self):
+        with self._lock:
+            self._open()
+            self._checked = time.time()
+
+
+class GeoIPResolver(object):
+    """
+    Country and city lookups backed by settings.GEOIP and settings.GEODAT.
+    """
+
+    def __init__(self, country_path, city_path, check_interval=60):
+        self.country = GeoIPDatabase(country_path, MMAP_CACHE, check_interval)
+        # pygeoip 0.2.4 only recognises the city edition through its
+        # (latin-1) file reader, the pages are still kept hot by the OS
+        self.city = GeoIPDatabase(city_path, STANDARD, check_interval)
+
+    def record_by_addr(self, addr):
+        return self.city.lookup('record_by_addr', addr)
+
+    def country_name_by_addr(self, addr):
+        return self.country.lookup('country_name_by_addr', addr)
+
+    def reload(self):
+        self.country.reload()
+        self.city.reload()
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+def get_resolver():
+    """ Returns the resolver shared by every request in this process. """
+    global _resolver
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                _resolver = GeoIPResolver(settings.GEOIP, settings.GEODAT,
+                                          settings.GEOIP_CHECK_INTERVAL)
+    return _resolver
@@ -29,8 +29,11 @@ import traceback
 import xmlrpclib 
 
 from django.conf import settings
+from django.db import connection
+from django.db.models.signals import post_save, post_delete
 
 from omero_qa.qa.models import Feedback, TestFile, AdditionalFile
+from omero_qa.registry.lru import LRUCache
 
 logger = logging.getLogger('delegator-qa')
 
@@ -209,3 +212,71 @@ def add_comment(tid, comment, trac):
         logger.error(traceback.format_exc())
         return x
     return tid
+
+
+# relations read by the feedback list templates for every row:
+# short_app_name, short_user_or_email, status and checkSelectedFile
+FEEDBACK_LIST_RELATED = ('app_name', 'user', 'status')
+FEEDBACK_LIST_PREFETCH = ('test_files', 'additional_files')
+
+
+def feedback_list(queryset):
+    """ The feedbacks of the queryset loaded with FEEDBACK_LIST_RELATED and _PREFETCH. """
+    return queryset.select_related(*FEEDBACK_LIST_RELATED).prefetch_related(*FEEDBACK_LIST_PREFETCH)
+
+
+# relations read by the feedback page, prepare_comparation and the
+# comments and tickets of the templates
+FEEDBACK_DETAIL_RELATED = ('app_name', 'user', 'status')
+FEEDBACK_DETAIL_PREFETCH = ('test_files', 'additional_files', 'user_comment__user', 'ticket__system')
+
+
+def feedback_detail(*args, **kwargs):
+    """
+    Feedback.objects.get(*args, **kwargs) loaded with FEEDBACK_DETAIL_RELATED
+    and _PREFETCH, a constant number of queries.
+    """
+    return Feedback.objects.select_related(*FEEDBACK_DETAIL_RELATED)\
+        .prefetch_related(*FEEDBACK_DETAIL_PREFETCH).get(*args, **kwargs)
+
+
+# number of feedbacks by filter signature, see feedback_count
+_feedback_counts = LRUCache('feedback_counts', 100, settings.QA_FEEDBACK_COUNT_TIMEOUT)
+
+
+def _estimated_count():
+    """ The planner estimate of the feedback rows on PostgreSQL, or None. """
+    if 'postgresql' not in connection.settings_dict['ENGINE']:
+        return None
+    cursor = connection.cursor()
+    cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s", [Feedback._meta.db_table])
+    row = cursor.fetchone()
+    return row is not None and int(row[0]) or None
+
+
+def feedback_count(signature, args, queryset=None):
+    """
+    Number of feedbacks of the queryset, all by default, matching the Q
+    args, cached by the signature of the filter. Without filter the
+    planner estimate is used once over QA_FEEDBACK_EXACT_COUNT rows.
+    """
+    count = _feedback_counts.get(signature)
+    if count is None:
+        if queryset is None:
+            if len(args) == 0:
+                estimate = _estimated_count()
+                if estimate is not None and estimate > settings.QA_FEEDBACK_EXACT_COUNT:
+                    count = estimate
+            queryset = Feedback.objects.all()
+        if count is None:
+            count = queryset.filter(*args).count()
+        _feedback_counts.set(signature, count)
+    return count
+
+
+def _clear_feedback_counts(sender, **kwargs):
+    # any saved field may move the feedback in or out of a filter
+    _feedback_counts.clear()
+
+post_save.connect(_clear_feedback_counts, sender=Feedback, dispatch_uid='qa_feedback_counts')
+post_delete.connect(_clear_feedback_counts, sender=Feedback, dispatch_uid='qa_feedback_counts_delete')
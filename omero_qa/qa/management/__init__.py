@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+from django.db.models.signals import post_syncdb
+
+import omero_qa.qa.models
+
+
+def create_search_index(sender, **kwargs):
+    from omero_qa.qa.search import search_index
+    if search_index.create() and int(kwargs.get('verbosity', 1)) > 0:
+        print "Creating full-text search index"
+
+post_syncdb.connect(create_search_index, sender=omero_qa.qa.models, dispatch_uid='qa_search_index')
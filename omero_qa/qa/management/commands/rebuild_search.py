@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import transaction
+
+from omero_qa.qa.search import search_index
+
+
+class Command(NoArgsCommand):
+    help = "Indexes every feedback again in the full-text search index."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+                    help='Number of feedbacks read at once.'),
+    )
+
+    def handle_noargs(self, **options):
+        if search_index.backend is None:
+            raise CommandError("The database has no full-text search.")
+        with transaction.commit_on_success():
+            total = search_index.rebuild(options['batch_size'])
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write("%i feedbacks indexed\n" % total)
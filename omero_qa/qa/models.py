@@ -66,7 +66,7 @@ class TestFile(models.Model):
     file_name = models.CharField(max_length=250)
     file_path = models.TextField(blank=True)
     file_format = models.ForeignKey(FileFormat, blank=True, null=True)
-    upload_date = models.DateTimeField(default=datetime.now)
+    upload_date = models.DateTimeField(default=datetime.now, db_index=True)
     
     def __unicode__(self):
         c = "%s" % (self.file_name)
@@ -203,6 +203,9 @@ class Feedback(models.Model):
     status = models.ForeignKey(FeedbackStatus, default=1)
     import_session = models.ForeignKey(ImportSession, blank=True, null=True)
     user_comment = models.ManyToManyField(UserComment, blank=True, null=True)
+    # location of ip_address, set by the first view of the feedback
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
 
     def __unicode__(self):
         c = "%s" % (self.token)
@@ -281,7 +284,7 @@ class Feedback(models.Model):
 class TestEngineResult(models.Model):
 
     test_file = models.ForeignKey(TestFile)
-    started = models.DateTimeField(blank=True, null=True)
+    started = models.DateTimeField(blank=True, null=True, db_index=True)
     ended = models.DateTimeField(blank=True, null=True)
     error = models.TextField(blank=True)
 
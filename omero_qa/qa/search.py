@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+''' Full-text index of the feedbacks.
+
+qa_feedbacksearch holds two documents per feedback: 'content' (error,
+comment, application version and file names) and 'reporter' (email, user
+name and full name). It is a tsvector table with GIN indexes on
+PostgreSQL and an FTS5 table on SQLite, created by syncdb. The words of
+the documents and of the searches are split on anything but letters and
+digits, a search matches the feedbacks containing every word as a
+prefix of one of theirs. filter and rank apply a search to a queryset of
+feedbacks, search lists the best matches. On other databases available
+is False and the callers keep their LIKE filters.
+
+The index is updated when a feedback is saved, "python manage.py
+rebuild_search" indexes every feedback again.'''
+
+import re
+import logging
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.signals import post_save, post_delete
+
+from omero_qa.qa.models import Feedback
+
+logger = logging.getLogger('search-qa')
+
+TABLE = 'qa_feedbacksearch'
+
+FIELDS = ('content', 'reporter')
+
+WORD = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def words(text):
+    return WORD.findall((text or u"").lower())
+
+
+def documents(feedback):
+    """ {field: normalised text} of the feedback. """
+    content = [feedback.error, feedback.comment, feedback.app_version, feedback.selected_file]
+    if feedback.id is not None:
+        content.extend(feedback.test_files.values_list('file_name', flat=True))
+        content.extend(feedback.additional_files.values_list('file_name', flat=True))
+    reporter = [feedback.email]
+    if feedback.user_id is not None:
+        user = feedback.user
+        reporter.extend([user.email, user.username, user.first_name, user.last_name])
+    return {'content': u" ".join(words(u" ".join([c for c in content if c]))),
+            'reporter': u" ".join(words(u" ".join([r for r in reporter if r])))}
+
+
+class PostgresBackend(object):
+
+    def create(self, cursor):
+        cursor.execute("CREATE TABLE %s (feedback_id integer PRIMARY KEY \
+                REFERENCES qa_feedback (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, \
+                content tsvector NOT NULL, reporter tsvector NOT NULL)" % TABLE)
+        for field in FIELDS:
+            cursor.execute("CREATE INDEX %s_%s ON %s USING gin (%s)" % (TABLE, field, TABLE, field))
+
+    def insert(self, cursor, fid, docs):
+        cursor.execute("INSERT INTO %s (feedback_id, content, reporter) \
+                VALUES (%%s, to_tsvector('simple', %%s), to_tsvector('simple', %%s))" % TABLE,
+                [fid, docs['content'], docs['reporter']])
+
+    def delete(self, cursor, fid=None):
+        if fid is None:
+            cursor.execute("DELETE FROM %s" % TABLE)
+        else:
+            cursor.execute("DELETE FROM %s WHERE feedback_id = %%s" % TABLE, [fid])
+
+    def query(self, field, terms):
+        return " & ".join(["%s:*" % t for t in terms])
+
+    def search(self, cursor, field, terms, limit):
+        cursor.execute("SELECT feedback_id, ts_rank(%s, query) AS rank \
+                FROM %s, to_tsquery('simple', %%s) query \
+                WHERE %s @@ query ORDER BY rank DESC, feedback_id DESC LIMIT %%s" % (field, TABLE, field),
+                [self.query(field, terms), limit])
+        return cursor.fetchall()
+
+    def where(self, field):
+        return "qa_feedback.id IN (SELECT feedback_id FROM %s \
+                WHERE %s @@ to_tsquery('simple', %%s))" % (TABLE, field)
+
+    def rank(self, field):
+        return "SELECT ts_rank(%s, to_tsquery('simple', %%s)) FROM %s \
+                WHERE feedback_id = qa_feedback.id" % (field, TABLE)
+
+
+class SqliteBackend(object):
+
+    def create(self, cursor):
+        cursor.execute("CREATE VIRTUAL TABLE %s USING fts5(content, reporter)" % TABLE)
+
+    def insert(self, cursor, fid, docs):
+        cursor.execute("INSERT INTO %s (rowid, content, reporter) VALUES (%%s, %%s, %%s)" % TABLE,
+                       [fid, docs['content'], docs['reporter']])
+
+    def delete(self, cursor, fid=None):
+        if fid is None:
+            cursor.execute("DELETE FROM %s" % TABLE)
+        else:
+            cursor.execute("DELETE FROM %s WHERE rowid = %%s" % TABLE, [fid])
+
+    def query(self, field, terms):
+        return "%s : (%s)" % (field, " AND ".join(['"%s"*' % t for t in terms]))
+
+    def search(self, cursor, field, terms, limit):
+        # bm25 is lower for the better matches
+        cursor.execute("SELECT rowid, -bm25(%s) FROM %s WHERE %s MATCH %%s \
+                ORDER BY bm25(%s), rowid DESC LIMIT %%s" % (TABLE, TABLE, TABLE, TABLE),
+                [self.query(field, terms), limit])
+        return cursor.fetchall()
+
+    def where(self, field):
+        return "qa_feedback.id IN (SELECT rowid FROM %s WHERE %s MATCH %%s)" % (TABLE, TABLE)
+
+    def rank(self, field):
+        return "SELECT -bm25(%s) FROM %s WHERE %s MATCH %%s \
+                AND rowid = qa_feedback.id" % (TABLE, TABLE, TABLE)
+
+
+def get_backend():
+    engine = connection.settings_dict['ENGINE']
+    if 'postgresql' in engine:
+        return PostgresBackend()
+    if 'sqlite3' in engine:
+        cursor = connection.cursor()
+        cursor.execute("PRAGMA compile_options")
+        if "ENABLE_FTS5" in [o[0] for o in cursor.fetchall()]:
+            return SqliteBackend()
+    return None
+
+
+class SearchIndex(object):
+    """ The feedback index of the database backend, see the module doc. """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._backend = False
+        self._available = False
+
+    @property
+    def backend(self):
+        if self._backend is False:
+            self._backend = get_backend()
+        return self._backend
+
+    @property
+    def available(self):
+        # the table is not dropped once created
+        if not self._available:
+            self._available = self.backend is not None and TABLE in connection.introspection.table_names()
+        return self._available
+
+    def create(self):
+        """ Creates the index table unless it exists, returns True if created. """
+        if self.backend is None or TABLE in connection.introspection.table_names():
+            return False
+        self.backend.create(connection.cursor())
+        transaction.commit_unless_managed()
+        logger.info("Search index '%s' created" % TABLE)
+        return True
+
+    def update(self, feedback):
+        if not self.available:
+            return
+        cursor = connection.cursor()
+        self.backend.delete(cursor, feedback.id)
+        self.backend.insert(cursor, feedback.id, documents(feedback))
+        # the signals come after the feedback was committed
+        transaction.commit_unless_managed()
+
+    def delete(self, fid):
+        if not self.available:
+            return
+        self.backend.delete(connection.cursor(), fid)
+        transaction.commit_unless_managed()
+
+    def rebuild(self, batch_size=1000):
+        """ Indexes every feedback again, returns their number. """
+        if self.backend is None:
+            return 0
+        self.create()
+        cursor = connection.cursor()
+        self.backend.delete(cursor)
+        total = 0
+        last = 0
+        while True:
+            batch = list(Feedback.objects.filter(id__gt=last).select_related('user').order_by('id')[:batch_size])
+            if not batch:
+                break
+            for feedback in batch:
+                self.backend.insert(cursor, feedback.id, documents(feedback))
+            last = batch[-1].id
+            total += len(batch)
+        logger.info("%i feedbacks indexed" % total)
+        return total
+
+    def search(self, text, field='content'):
+        """
+        Returns the [(feedback id, rank)] matching every word of the text
+        in the field, the best first, or None without index.
+        """
+        if field not in FIELDS:
+            raise ValueError("Unknown search field '%s'" % field)
+        if not self.available:
+            return None
+        terms = words(text)
+        if not terms:
+            return []
+        return self.backend.search(connection.cursor(), field, terms, self.limit)
+
+    def filter(self, queryset, text, field='content'):
+        """
+        The feedbacks of the queryset matching every word of the text in
+        the field, a subquery of the index without limit, or None without
+        index.
+        """
+        if field not in FIELDS:
+            raise ValueError("Unknown search field '%s'" % field)
+        if not self.available:
+            return None
+        terms = words(text)
+        if not terms:
+            return queryset.none()
+        return queryset.extra(where=[self.backend.where(field)],
+                              params=[self.backend.query(field, terms)])
+
+    def rank(self, queryset, text, field='content'):
+        """ The queryset ordered by the rank of the text in the field, the best first. """
+        terms = words(text)
+        if not self.available or not terms:
+            return queryset.order_by("-id")
+        return queryset.extra(select={'rank': self.backend.rank(field)},
+                              select_params=[self.backend.query(field, terms)],
+                              order_by=["-rank", "-id"])
+
+
+search_index = SearchIndex(settings.QA_SEARCH_LIMIT)
+
+
+def _index_feedback(sender, instance, **kwargs):
+    search_index.update(instance)
+
+
+def _unindex_feedback(sender, instance, **kwargs):
+    search_index.delete(instance.id)
+
+post_save.connect(_index_feedback, sender=Feedback, dispatch_uid='qa_feedback_search')
+post_delete.connect(_unindex_feedback, sender=Feedback, dispatch_uid='qa_feedback_search_delete')
@@ -0,0 +1,250 @@
+from datetime import datetime
+
+from django.test import TestCase, TransactionTestCase
+from django.test import Client
+from django.core.urlresolvers import reverse
+from django.core.management import call_command
+from django.contrib.auth.models import User
+
+from django.conf import settings
+from django.db import connection
+
+from omero_qa.qa.delegator import feedback_count, _feedback_counts
+from omero_qa.qa.models import Feedback, FeedbackStatus, AppType, TestFile, AdditionalFile, FileFormat, \
+    TestEngineResult, Trac, TracSystem, UserComment
+from omero_qa.qa.search import search_index
+
+
+class FeedbackPagingTestCase(TestCase):
+
+    def setUp(self):
+        _feedback_counts.clear()
+        FeedbackStatus.objects.create(status="New")
+        self.app = AppType.objects.create(app_name="OMERO.insight")
+        for i in range(settings.PERPAGE * 2 + 10):
+            Feedback.objects.create(app_name=self.app, token="t%i" % i, error="error %i" % i)
+        User.objects.create_superuser("staff", "staff@example.com", "secret")
+        self.client = Client()
+        self.client.login(username="staff", password="secret")
+
+    def tearDown(self):
+        _feedback_counts.clear()
+
+    def ids(self, response):
+        return [f.id for f in response.context['feedback']]
+
+    def test_cursors(self):
+        ids = list(Feedback.objects.order_by("-id").values_list('id', flat=True))
+        first = self.client.get(reverse('feedback'), {'do_filter': 1})
+        self.assertEqual(self.ids(first), ids[:settings.PERPAGE])
+        paging = first.context['paging']
+        self.assertEqual(paging['before'], ids[settings.PERPAGE-1])
+        self.assertEqual(paging['after'], None)
+
+        second = self.client.get(reverse('feedback'), {'do_filter': 1, 'page': 2, 'before': paging['before']})
+        self.assertEqual(self.ids(second), ids[settings.PERPAGE:settings.PERPAGE*2])
+        paging = second.context['paging']
+        third = self.client.get(reverse('feedback'), {'do_filter': 1, 'page': 3, 'before': paging['before']})
+        self.assertEqual(self.ids(third), ids[settings.PERPAGE*2:])
+        self.assertEqual(third.context['paging']['next'], None)
+
+        back = self.client.get(reverse('feedback'), {'do_filter': 1, 'page': 1, 'after': paging['after']})
+        self.assertEqual(self.ids(back), ids[:settings.PERPAGE])
+
+        # the numbered pages still work
+        numbered = self.client.get(reverse('feedback'), {'do_filter': 1, 'page': 2})
+        self.assertEqual(self.ids(numbered), ids[settings.PERPAGE:settings.PERPAGE*2])
+
+    def test_cached_count(self):
+        with self.assertNumQueries(1):
+            count = feedback_count('all', [])
+        self.assertEqual(count, Feedback.objects.count())
+        with self.assertNumQueries(0):
+            feedback_count('all', [])
+        Feedback.objects.create(app_name=self.app, token="new")
+        self.assertEqual(feedback_count('all', []), settings.PERPAGE * 2 + 11)
+
+    def test_status_change(self):
+        new = FeedbackStatus.objects.get(status="New")
+        closed = FeedbackStatus.objects.create(status="Closed")
+        url = reverse('feedback')
+        response = self.client.get(url, {'do_filter': 1, 'status': closed.id})
+        self.assertEqual(response.context['paging']['next'], None)
+        response = self.client.get(url, {'do_filter': 1, 'status': new.id})
+        self.assertEqual(response.context['paging']['total'], [1, 2, 3])
+        # triaged as the status_update action does
+        for feedback in Feedback.objects.order_by("id")[:settings.PERPAGE + 10]:
+            feedback.status = closed
+            feedback.save()
+        response = self.client.get(url, {'do_filter': 1, 'status': closed.id})
+        self.assertEqual(response.context['paging']['next'], 2)
+        self.assertEqual(response.context['paging']['total'], [1, 2])
+        response = self.client.get(url, {'do_filter': 1, 'status': new.id})
+        self.assertEqual(response.context['paging']['next'], None)
+
+
+def skip_without_index(test):
+    if search_index.backend is None:
+        test.skipTest("No full-text search on this database")
+
+
+class SearchIndexTestCase(TestCase):
+
+    def setUp(self):
+        skip_without_index(self)
+        FeedbackStatus.objects.create(status="New")
+        app = AppType.objects.create(app_name="OMERO.importer")
+        user = User.objects.create_user("jdoe", "jane@example.com", "secret")
+        self.npe = Feedback.objects.create(app_name=app, token="a", user=user,
+                                           error="java.lang.NullPointerException at loci.formats.ImageReader")
+        self.tiff = Feedback.objects.create(app_name=app, token="b", email="bob@example.org",
+                                            error="Cannot read TIFF", comment="tiff tiff, tiff again",
+                                            selected_file="sample.ome.tiff")
+        Feedback.objects.create(app_name=app, token="c", error="Cannot read TIFF tag")
+
+    def ids(self, found):
+        return [r[0] for r in found]
+
+    def test_index(self):
+        self.assertTrue(search_index.available)
+        self.assertEqual(self.ids(search_index.search("nullpointer")), [self.npe.id])
+        self.assertEqual(self.ids(search_index.search("LOCI formats")), [self.npe.id])
+        self.assertEqual(search_index.search("loci tiff"), [])
+        # ranked by the number of occurrences
+        self.assertEqual(self.ids(search_index.search("tiff"))[0], self.tiff.id)
+        self.assertEqual(len(search_index.search("tiff")), 2)
+
+    def test_reporter(self):
+        self.assertEqual(self.ids(search_index.search("jane", 'reporter')), [self.npe.id])
+        self.assertEqual(self.ids(search_index.search("bob@example", 'reporter')), [self.tiff.id])
+        self.assertEqual(search_index.search("jane"), [])
+
+    def test_update(self):
+        self.npe.error = "OutOfMemoryError"
+        self.npe.save()
+        self.assertEqual(search_index.search("nullpointer"), [])
+        self.assertEqual(self.ids(search_index.search("outofmemory")), [self.npe.id])
+        self.tiff.delete()
+        self.assertEqual(len(search_index.search("tiff")), 1)
+
+    def test_rebuild(self):
+        call_command('rebuild_search', verbosity=0)
+        self.assertEqual(self.ids(search_index.search("nullpointer")), [self.npe.id])
+
+    def test_view(self):
+        User.objects.create_superuser("staff", "staff@example.com", "secret")
+        client = Client()
+        client.login(username="staff", password="secret")
+        response = client.get(reverse('feedback'), {'do_filter': 1, 'text': "tiff"})
+        # the best match first
+        self.assertEqual([f.id for f in response.context['feedback']],
+                         self.ids(search_index.search("tiff")))
+        # the other filters apply to every match
+        limit, search_index.limit = search_index.limit, 1
+        try:
+            response = client.get(reverse('feedback'), {'do_filter': 1, 'text': "cannot read",
+                                                        'useremail': "bob"})
+            self.assertEqual([f.id for f in response.context['feedback']], [self.tiff.id])
+            response = client.get(reverse('feedback'), {'do_filter': 1, 'text': "tiff"})
+            self.assertEqual(len(response.context['feedback']), 2)
+        finally:
+            search_index.limit = limit
+
+
+class SearchIndexCommitTestCase(TransactionTestCase):
+
+    def setUp(self):
+        skip_without_index(self)
+
+    def test_committed(self):
+        app = AppType.objects.create(app_name="OMERO.importer")
+        feedback = Feedback.objects.create(app_name=app, token="a", error="NullPointerException")
+        # the uncommitted writes are lost when the request closes the connection
+        connection._rollback()
+        self.assertEqual([r[0] for r in search_index.search("nullpointer")], [feedback.id])
+        feedback.delete()
+        connection._rollback()
+        self.assertEqual(search_index.search("nullpointer"), [])
+
+
+class FeedbackListQueriesTestCase(TestCase):
+
+    # session, token feedback, user, count, page, test and additional
+    # files, status choices, application tabs, session save (2); it does
+    # not depend on the number of rows
+    BUDGET = 11
+
+    def setUp(self):
+        _feedback_counts.clear()
+        FeedbackStatus.objects.create(status="New")
+        app = AppType.objects.create(app_name="OMERO.insight")
+        for i in range(settings.PERPAGE):
+            user = User.objects.create_user("user%i" % i, "user%i@example.com" % i, "secret")
+            feedback = Feedback.objects.create(app_name=app, token="t%i" % i, user=user,
+                                               selected_file="f%i.tiff" % i)
+            feedback.test_files.add(TestFile.objects.create(file_name="f%i.tiff" % i))
+            feedback.additional_files.add(AdditionalFile.objects.create(file_name="f%i.tiff" % i))
+        User.objects.create_superuser("staff", "staff@example.com", "secret")
+        self.client = Client()
+        self.client.login(username="staff", password="secret")
+
+    def tearDown(self):
+        _feedback_counts.clear()
+
+    def test_staff_list(self):
+        with self.assertNumQueries(self.BUDGET):
+            response = self.client.get(reverse('feedback'), {'do_filter': 1})
+        self.assertEqual(len(response.context['feedback']), settings.PERPAGE)
+
+
+class FeedbackDetailQueriesTestCase(TestCase):
+
+    def setUp(self):
+        FeedbackStatus.objects.create(status="New")
+        self.app = AppType.objects.create(app_name="OMERO.importer")
+        self.tiff = FileFormat.objects.create(format_name="TIFF", selected="tiff")
+        system = TracSystem.objects.create(name="trac", url="trac.example.com", username="u", password="p")
+        User.objects.create_superuser("staff", "staff@example.com", "secret")
+        self.feedbacks = list()
+        for n in (1, 5):
+            feedback = Feedback.objects.create(app_name=self.app, token="t%i" % n, ip_address="192.168.1.%i" % n,
+                                               selected_file="f0.tiff", error="failed")
+            for i in range(n):
+                feedback.test_files.add(TestFile.objects.create(file_name="f%i.tiff" % i, file_format=self.tiff))
+                feedback.additional_files.add(AdditionalFile.objects.create(file_name="f%i.tiff" % i, file_path="/data"))
+                feedback.user_comment.add(UserComment.objects.create(comment="c%i" % i, email="c%i@example.com" % i))
+                feedback.ticket.add(Trac.objects.create(ticket=i, system=system))
+            TestEngineResult.objects.create(test_file=feedback.test_files.all()[0], started=datetime.now())
+            self.feedbacks.append(feedback)
+        self.client = Client()
+        self.client.login(username="staff", password="secret")
+
+    def view(self, feedback):
+        return self.client.get(reverse('qa_feedback_id', args=[feedback.id]))
+
+    # session, user, feedback with its application, user and status, test
+    # files, additional files, comments and their users, tickets and their
+    # systems, status choices and validation, test results; it does not
+    # depend on the number of files, comments or tickets
+    BUDGET = 12
+
+    def test_constant_queries(self):
+        small, large = self.feedbacks
+        # the first view stores the location
+        self.view(small)
+        self.view(large)
+        with self.assertNumQueries(self.BUDGET):
+            self.view(small)
+        with self.assertNumQueries(self.BUDGET):
+            response = self.view(large)
+        self.assertEqual(response.context['format'], self.tiff.id)
+        self.assertEqual(response.context['geo'], (56.457670, -2.986810))
+        self.assertEqual(len(response.context['fileset']['existing']), 5)
+        self.assertEqual(len(response.context['test_results']), 1)
+        self.assertContains(response, "5 comments")
+
+    def test_location(self):
+        feedback = self.feedbacks[0]
+        self.view(feedback)
+        feedback = Feedback.objects.get(pk=feedback.id)
+        self.assertEqual((feedback.latitude, feedback.longitude), (56.457670, -2.986810))
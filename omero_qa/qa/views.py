@@ -40,7 +40,6 @@ import urlparse
 from datetime import date, datetime, timedelta
 from django.views.decorators.csrf import csrf_exempt
 
-from pygeoip import GeoIP, STANDARD
 from ipaddr import IPv4Address
 
 import urllib
@@ -70,6 +69,7 @@ from django.core.mail import EmailMultiAlternatives
 from django.db.models import Q
 
 from omero_qa.feedback.views import handlerInternalError
+from omero_qa.geolocation import get_resolver
 from omero_qa.qa.models import JUnitResult, TestNGXML, TestFile2, MetadataTest, MetadataTestResult, \
     Feedback, AppType, FileFormat, FeedbackStatus, AdditionalFile, TestEngineResult, \
     NotificationList
@@ -77,7 +77,9 @@ from omero_qa.qa.forms import LoginForm, UserForm, UploadFileForm, \
     FileTypeForm, EmailForm,  FeedbackForm, StatusForm, TestEngineResultForm, \
     CommentForm, UserCommentForm, TicketForm, ExistingTicketForm, FilterFeedbackForm
 
-from omero_qa.qa.delegator import UploadProccessing, prepare_comparation, create_ticket, add_comment
+from omero_qa.qa.delegator import UploadProccessing, prepare_comparation, create_ticket, add_comment, \
+    feedback_count, feedback_list, feedback_detail
+from omero_qa.qa.search import search_index
 
 
 logger = logging.getLogger('views-qa')
@@ -114,7 +116,12 @@ def load_session_from_request(handler):
 
 
 ### HELPER ###
-def doPaging(page, page_size, total_size, limit):
+def doPaging(page, page_size, total_size, limit, first=None, last=None):
+    """
+    first and last are the ids of the first and last rows of the page,
+    returned as the 'after' and 'before' cursors of the prev and next
+    pages when given.
+    """
     total = list()
     t = total_size/limit
     if total_size > (limit*10):
@@ -136,7 +143,17 @@ def doPaging(page, page_size, total_size, limit):
     prev = None
     if page > 1:
         prev = page - 1
-    return {'page': page, 'total':total, 'next':next, "prev":prev}
+    before = next is not None and last or None
+    after = prev is not None and first or None
+    return {'page': page, 'total':total, 'next':next, "prev":prev, 'before':before, 'after':after}
+
+
+def get_cursor(request, name):
+    try:
+        cursor = int(request.REQUEST.get(name))
+    except (TypeError, ValueError):
+        return None
+    return cursor > 0 and cursor or None
 
 
 def create_response(request):
@@ -340,8 +357,7 @@ def get_lng_and_lat(ip_address):
         longitude = -2.986810 
     else:
         logger.debug("Checking ip: '%s' ..." % ip_address)
-        geoip = GeoIP(settings.GEODAT, STANDARD)
-        gir = geoip.record_by_addr(ip_address)
+        gir = get_resolver().record_by_addr(ip_address)
         if gir is not None:
             latitude = gir["latitude"]
             longitude = gir["longitude"]
@@ -351,6 +367,18 @@ def get_lng_and_lat(ip_address):
     logger.debug("IP: %s, latitude: '%s', longitude: '%s'" % (ip_address, latitude, longitude))
     return (latitude, longitude)
 
+
+def get_feedback_location(feedback):
+    """ get_lng_and_lat of the feedback address, kept on the feedback. """
+    if feedback.latitude is None or feedback.longitude is None:
+        geo = get_lng_and_lat(feedback.ip_address)
+        if geo is None:
+            return None
+        feedback.latitude, feedback.longitude = geo
+        # not a change of the feedback, nothing to notify or index
+        Feedback.objects.filter(pk=feedback.id).update(latitude=feedback.latitude, longitude=feedback.longitude)
+    return (feedback.latitude, feedback.longitude)
+
     
 ### VIEWS ###
 def index(request, **kwargs):        
@@ -716,16 +744,17 @@ def feedback(request, fid=None, action=None, **kwargs):
         try:
             if request.user.is_authenticated():
                 if request.user.is_staff:
-                    feedback = Feedback.objects.get(pk=fid)
+                    feedback = feedback_detail(pk=fid)
                 else:
-                    feedback = Feedback.objects.get(Q(pk=fid,user=request.user) | Q(pk=fid,email=request.user.email))
+                    feedback = feedback_detail(Q(pk=fid,user=request.user) | Q(pk=fid,email=request.user.email))
             else:
                 if (request.REQUEST.get('token') == None):
                     redirect = reverse('qa_feedback_id', args=[fid])
                     login_url = '%s?redirect=%s' % (reverse("index"), redirect)
                     return HttpResponseRedirect(login_url)
-                feedback = Feedback.objects.get(pk=fid, token=token)
-            test_results = TestEngineResult.objects.filter(test_file__in=feedback.test_files.all()).order_by("-started")
+                feedback = feedback_detail(pk=fid, token=token)
+            test_files = list(feedback.test_files.all())
+            test_results = TestEngineResult.objects.filter(test_file__in=[tf.id for tf in test_files]).order_by("-started")
             # compare additional and attached files
             fileset = prepare_comparation(feedback)
             if request.user.is_staff:
@@ -737,20 +766,16 @@ def feedback(request, fid=None, action=None, **kwargs):
         if feedback is None:
             raise Http404()
         
-        geo = get_lng_and_lat(feedback.ip_address)
+        geo = get_feedback_location(feedback)
         
         format = None
-        if feedback.test_files.all().count() > 0:
+        if len(test_files) > 0:
             if feedback.selected_file is not None and feedback.selected_file != "":
-                try:
-                    format = feedback.test_files.get(file_name=feedback.selected_file).file_format.id
-                except:
-                    pass
+                selected = [tf for tf in test_files if tf.file_name == feedback.selected_file]
+                if len(selected) == 1:
+                    format = selected[0].file_format_id
             else:
-                try:
-                    format = feedback.test_files.all()[0].file_format.id
-                except:
-                    pass
+                format = test_files[0].file_format_id
 
         # Check if action
         if request.method == 'POST':
@@ -887,6 +912,9 @@ def feedback(request, fid=None, action=None, **kwargs):
                 filter_form = FilterFeedbackForm()
             
             args = list()
+            # the index searches are subqueries of the feedback queries
+            queryset = Feedback.objects.all()
+            searched = ranked = False
             if q_status is not None:
                 params['status'] = str(q_status.id)
                 args.append(Q(status=q_status))
@@ -895,27 +923,54 @@ def feedback(request, fid=None, action=None, **kwargs):
                 args.append(Q(creation_date__gte=q_date))
             if q_text is not None and q_text != "":
                 params['text'] = q_text
-                args.append(Q(app_version__contains=q_text) | Q(comment__contains=q_text) | Q(error__contains=q_text) | Q(selected_file__contains=q_text))
+                found = search_index.filter(queryset, q_text, 'content')
+                if found is not None:
+                    queryset = found
+                    searched = ranked = True
+                else:
+                    args.append(Q(app_version__contains=q_text) | Q(comment__contains=q_text) | Q(error__contains=q_text) | Q(selected_file__contains=q_text))
             if q_useremail is not None and q_useremail != "":
                 params['useremail'] = q_useremail
-                args.append(Q(email__contains=q_useremail) | Q(user__email__contains=q_useremail) | Q(user__username__contains=q_useremail) | Q(user__first_name__contains=q_useremail) | Q(user__last_name__contains=q_useremail))
+                found = search_index.filter(queryset, filter_form.data.get('useremail'), 'reporter')
+                if found is not None:
+                    queryset = found
+                    searched = True
+                else:
+                    args.append(Q(email__contains=q_useremail) | Q(user__email__contains=q_useremail) | Q(user__username__contains=q_useremail) | Q(user__first_name__contains=q_useremail) | Q(user__last_name__contains=q_useremail))
             if app_name is not None:
                 args.append(Q(app_name=app_name))
             
-            if len(args) > 0:
-                count = Feedback.objects.filter(*args).count()
-                feedback = Feedback.objects.filter(*args).order_by("-id")[offset:limit]
+            signature = sorted(params.items())
+            signature.append(('type', app_name))
+            if searched:
+                count = feedback_count(repr(signature), args, queryset)
+            else:
+                count = feedback_count(repr(signature), args)
+            
+            # the prev and next pages are found from the ids of the
+            # current one, only the numbered pages use an offset
+            before = get_cursor(request, 'before')
+            after = get_cursor(request, 'after')
+            if ranked:
+                # the best matches first, paged by offset
+                feedback = list(feedback_list(search_index.rank(queryset.filter(*args), q_text))[offset:limit])
+            elif before is not None:
+                feedback = list(feedback_list(queryset.filter(*args)).filter(id__lt=before).order_by("-id")[:settings.PERPAGE])
+            elif after is not None:
+                feedback = list(feedback_list(queryset.filter(*args)).filter(id__gt=after).order_by("id")[:settings.PERPAGE])
+                feedback.reverse()
             else:
-                count = Feedback.objects.all().count()
-                feedback = Feedback.objects.all().order_by("-id")[offset:limit]
+                feedback = list(feedback_list(queryset.filter(*args)).order_by("-id")[offset:limit])
             
-            paging = doPaging(page, settings.PERPAGE, count,  settings.PERPAGE)
+            first = len(feedback) > 0 and not ranked and feedback[0].id or None
+            last = len(feedback) > 0 and not ranked and feedback[-1].id or None
+            paging = doPaging(page, len(feedback), count, settings.PERPAGE, first, last)
         elif request.user.is_authenticated():
             template = "qa/feedback_user.html"            
-            feedback = Feedback.objects.filter(Q(user=request.user) | Q(email=request.user.email))
+            feedback = feedback_list(Feedback.objects.filter(Q(user=request.user) | Q(email=request.user.email)))
         else:
             try:
-                feedback = Feedback.objects.filter(token=token)
+                feedback = feedback_list(Feedback.objects.filter(token=token))
             except:
                 logger.error(traceback.format_exc())
         
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+import time
+import logging
+import threading
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+
+from omero_qa.registry.models import Agent
+
+logger = logging.getLogger('agents-registry')
+
+
+class AgentRegistry(object):
+    """
+    Every Agent by agent_name, loaded once and kept for timeout seconds.
+    Saving or deleting an Agent reloads it in this process straight away.
+    As the whole table is held, User-Agent strings which are not agents
+    are answered from memory too.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._agents = None
+        self._loaded = 0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            self._agents = dict([(a.agent_name, a) for a in Agent.objects.all()])
+            self._loaded = time.time()
+            logger.debug("%i agents loaded" % len(self._agents))
+        return self._agents
+
+    def get(self, agent_name):
+        """ Returns the Agent or None if there is no such agent. """
+        agents = self._agents
+        if agents is None or time.time() - self._loaded > self.timeout:
+            agents = self._load()
+        return agents.get(agent_name)
+
+    def invalidate(self):
+        self._agents = None
+
+
+agent_registry = AgentRegistry(settings.REGISTRY_AGENT_TIMEOUT)
+
+
+def _invalidate_agents(sender, **kwargs):
+    agent_registry.invalidate()
+
+post_save.connect(_invalidate_agents, sender=Agent, dispatch_uid='registry_agent_save')
+post_delete.connect(_invalidate_agents, sender=Agent, dispatch_uid='registry_agent_delete')
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+''' PNG charts of the statistics, rendered once per version of their data.
+
+A chart is keyed by its name and the SHA-1 of the data it is drawn from.
+The image is kept in the 'charts' cache and served with that key as ETag
+and the rendering time as Last-Modified, so that the browsers revalidate
+with conditional requests answered by 304 while the data is unchanged.
+Figures are not registered with pyplot and are cleared once rendered,
+matplotlib is imported by the first chart rendered.'''
+
+import time
+import hashlib
+import logging
+from cStringIO import StringIO
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils import simplejson
+from django.utils.http import http_date, parse_http_date_safe
+
+logger = logging.getLogger('charts-registry')
+
+
+def _matplotlib():
+    """
+    Returns (Figure, FigureCanvasAgg, numpy). matplotlib is only imported
+    by the first chart rendered in the process, most workers never do.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import numpy
+    return Figure, FigureCanvasAgg, numpy
+
+
+def pie_chart(fig, data):
+    title, items = data
+    ax = fig.add_axes([0.1, 0.1, 0.8, 0.8])
+    ax.pie([v for k, v in items], labels=[k for k, v in items], autopct='%1.1f%%', shadow=True)
+    ax.set_title(title)
+
+
+def hits_chart(fig, data):
+    np = _matplotlib()[2]
+    title, labels, bars = data
+    ax = fig.add_subplot(111)
+    ind = np.arange(len(labels))    # the x locations for the groups
+    width = 0.35       # the width of the bars: can also be len(x) sequence
+    for name, values in bars:
+        ax.bar(ind, values, width)
+    ax.set_ylabel('Hits')
+    ax.set_xlabel('Days')
+    ax.set_title(title)
+    ax.set_xticks(ind+width)
+    ax.set_xticklabels(labels, rotation=90)
+
+
+def results_chart(fig, data):
+    np = _matplotlib()[2]
+    total, month, today = data
+    ind = np.arange(3)  # the x locations for the groups
+    width = 0.15       # the width of the bars
+
+    ax = fig.add_subplot(111)
+    rects1 = ax.bar(ind, total, width, color='g')
+    rects2 = ax.bar(ind+width, month, width, color='b')
+    rects3 = ax.bar(ind+2*width, today, width, color='r')
+
+    ax.set_ylabel('Files')
+    ax.set_title('')
+    ax.set_xticks(ind+1.5*width)
+    ax.set_xticklabels(('Uploaded', 'Tested', 'Failure'))
+    ax.legend((rects1[0], rects2[0], rects3[0]), ('Total', 'Month', 'Today'))
+
+    # attach some text labels
+    for rects in (rects1, rects2, rects3):
+        for rect in rects:
+            height = rect.get_height()
+            if height > 0:
+                ax.text(rect.get_x()+rect.get_width()/2., height-3, '%d'%int(height),
+                        ha='center', va='bottom')
+
+
+class ChartCache(object):
+    """
+    Rendered charts by name and data version, see response.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return get_cache('charts')
+
+    def version(self, name, data):
+        return hashlib.sha1(simplejson.dumps([name, data], sort_keys=True)).hexdigest()
+
+    def render(self, draw, data):
+        Figure, FigureCanvas = _matplotlib()[:2]
+        fig = Figure()
+        try:
+            draw(fig, data)
+            canvas = FigureCanvas(fig)
+            imdata = StringIO()
+            canvas.print_figure(imdata)
+            return imdata.getvalue()
+        finally:
+            fig.clf()
+
+    def get(self, name, data, draw, version=None):
+        """ Returns (PNG, rendering time) of the chart of the data. """
+        if version is None:
+            version = self.version(name, data)
+        key = "chart_%s_%s" % (name, version)
+        chart = self.cache.get(key)
+        if chart is None:
+            chart = (self.render(draw, data), int(time.time()))
+            self.cache.set(key, chart, self.timeout)
+            logger.debug("Chart '%s' rendered" % key)
+        return chart
+
+    def response(self, request, name, data, draw):
+        """
+        The chart as image/png, or 304 if the browser already has this
+        version of it.
+        """
+        version = self.version(name, data)
+        etag = '"%s"' % version
+        if etag in [e.strip() for e in request.META.get('HTTP_IF_NONE_MATCH', '').split(",")]:
+            rsp = HttpResponseNotModified()
+            rsp['ETag'] = etag
+            return rsp
+        png, modified = self.get(name, data, draw, version)
+        since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if since is not None and not request.META.has_key('HTTP_IF_NONE_MATCH') and since >= modified:
+            rsp = HttpResponseNotModified()
+        else:
+            rsp = HttpResponse(png, mimetype='image/png')
+        rsp['ETag'] = etag
+        rsp['Last-Modified'] = http_date(modified)
+        return rsp
+
+
+chart_cache = ChartCache(settings.REGISTRY_CHART_TIMEOUT)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+''' Clusters of the geomap markers by zoom level.
+
+The located addresses are counted in a grid whose cells are a quarter of
+a map tile wide at the zoom level, broken down by agent ("unknown" for
+the addresses without hits). The grid of the deepest zoom level is built
+from one scan of registry_ip, each coarser grid merges the cells of the
+next one. The grids are built ahead of the requests with the markers, see
+registry.markers, and kept in the 'markers' cache; the requests only read
+them.'''
+
+import math
+import logging
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.db import connection
+
+from omero_qa.registry.delegator import fetch_rows
+from omero_qa.registry.lru import LRUCache
+
+logger = logging.getLogger('clusters-registry')
+
+# cells per map tile width
+CELLS_PER_TILE = 4
+
+CLUSTER_SQL = "SELECT registry_ip.id, registry_ip.latitude, registry_ip.longitude, registry_agent.display_name \
+        FROM registry_ip \
+        LEFT OUTER JOIN (SELECT DISTINCT ip_id, agent_id FROM registry_hit) hits \
+        ON hits.ip_id = registry_ip.id \
+        LEFT OUTER JOIN registry_agent ON registry_agent.id = hits.agent_id \
+        WHERE registry_ip.latitude IS NOT NULL AND registry_ip.longitude IS NOT NULL \
+        ORDER BY registry_ip.id"
+
+
+def cell_size(zoom):
+    """ Width of a cluster cell in degrees at the zoom level. """
+    return 360.0 / (2 ** zoom) / CELLS_PER_TILE
+
+
+def in_bbox(latitude, longitude, bbox):
+    """ bbox is (west, south, east, north), west > east across 180. """
+    if bbox is None:
+        return True
+    w, s, e, n = bbox
+    if latitude < s or latitude > n:
+        return False
+    if w <= e:
+        return w <= longitude <= e
+    return longitude >= w or longitude <= e
+
+
+def cluster_key(zoom):
+    return "clusters%i" % zoom
+
+
+class MarkerClusters(object):
+    """
+    Per zoom level grids of (addresses, latitude sum, longitude sum,
+    {agent display name: addresses}) by cell, kept for timeout seconds in
+    the 'markers' cache and read again every read_timeout seconds.
+    """
+
+    def __init__(self, max_zoom, timeout, read_timeout):
+        self.max_zoom = max_zoom
+        self.timeout = timeout
+        self.grids = LRUCache('marker_clusters', max_zoom+1, read_timeout)
+
+    @property
+    def cache(self):
+        return get_cache('markers')
+
+    def build(self):
+        """ Builds and stores the grid of every zoom level, returns their cells. """
+        size = cell_size(self.max_zoom)
+        grid = dict()
+        cursor = connection.cursor()
+        cursor.execute(CLUSTER_SQL)
+        last = None
+        for ip_id, latitude, longitude, agent_name in fetch_rows(cursor):
+            key = (int(math.floor((longitude + 180) / size)), int(math.floor((latitude + 90) / size)))
+            cell = grid.get(key)
+            if cell is None:
+                cell = grid[key] = [0, 0.0, 0.0, dict()]
+            if ip_id != last:
+                # one row per agent of the address
+                cell[0] += 1
+                cell[1] += latitude
+                cell[2] += longitude
+                last = ip_id
+            agent_name = agent_name is not None and agent_name or "unknown"
+            cell[3][agent_name] = cell[3].get(agent_name, 0) + 1
+        cells = 0
+        for zoom in range(self.max_zoom, -1, -1):
+            if zoom < self.max_zoom:
+                # the cells are half as wide at the next zoom level
+                coarser = dict()
+                for (x, y), (count, lat_sum, lon_sum, agents) in grid.iteritems():
+                    cell = coarser.get((x / 2, y / 2))
+                    if cell is None:
+                        cell = coarser[(x / 2, y / 2)] = [0, 0.0, 0.0, dict()]
+                    cell[0] += count
+                    cell[1] += lat_sum
+                    cell[2] += lon_sum
+                    for name, n in agents.iteritems():
+                        cell[3][name] = cell[3].get(name, 0) + n
+                grid = coarser
+            self.cache.set(cluster_key(zoom), grid, self.timeout)
+            self.grids.set(zoom, grid)
+            cells += len(grid)
+        logger.info("%i clusters built up to zoom %i" % (cells, self.max_zoom))
+        return cells
+
+    def grid(self, zoom):
+        """ The grid of the zoom level, empty until build has run. """
+        zoom = max(0, min(zoom, self.max_zoom))
+        grid = self.grids.get(zoom)
+        if grid is None:
+            grid = self.cache.get(cluster_key(zoom))
+            if grid is None:
+                logger.info("Clusters of zoom %i not built" % zoom)
+                return dict()
+            self.grids.set(zoom, grid)
+        return grid
+
+    def clusters(self, zoom, bbox=None, agent_name=None):
+        """
+        Yields the (latitude, longitude, addresses, {agent: addresses})
+        clusters at the zoom level whose centre is within the bbox, only
+        counting the addresses of agent_name if given.
+        """
+        for count, lat_sum, lon_sum, agents in self.grid(zoom).itervalues():
+            latitude = lat_sum / count
+            longitude = lon_sum / count
+            if agent_name is not None:
+                if agent_name not in agents:
+                    continue
+                count = agents[agent_name]
+                agents = {agent_name: count}
+            if in_bbox(latitude, longitude, bbox):
+                yield (latitude, longitude, count, agents)
+
+    def clear(self):
+        self.grids.clear()
+        for zoom in range(self.max_zoom + 1):
+            self.cache.delete(cluster_key(zoom))
+
+
+marker_clusters = MarkerClusters(settings.REGISTRY_CLUSTER_MAX_ZOOM, settings.CACHE_TIMEOUT,
+                                 settings.REGISTRY_CLUSTER_TIMEOUT)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+import time
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+from omero_qa.registry.lru import LRUCache
+
+logger = logging.getLogger('counts-registry')
+
+COUNT_SQL = """SELECT %s, registry_hit.agent_id, count(*) \
+        FROM registry_hit, registry_ip \
+        WHERE registry_hit.ip_id=registry_ip.id \
+        AND registry_ip.latitude IS NOT NULL \
+        AND registry_ip.longitude IS NOT NULL \
+        AND registry_hit.id > %%s AND registry_hit.id <= %%s \
+        GROUP BY %s, registry_hit.agent_id"""
+
+
+class HitCounts(object):
+    """
+    Located hits per (column value, agent id). The hits up to a settled
+    Hit.id are counted once and kept, the last window ids are recounted
+    whenever the number of hits above the settled id changes, so that the
+    write-behind batches committed out of id order are not missed. The
+    whole table is recounted timeout seconds after its previous recount,
+    for the batches committed below the settled id.
+    """
+
+    def __init__(self, timeout, window):
+        self.timeout = timeout
+        self.window = window
+        self.tables = LRUCache('hit_counts', 32)
+        self._lock = threading.Lock()
+
+    def _count(self, cursor, column, first, last, counts):
+        cursor.execute(COUNT_SQL % (column, column), [first, last])
+        for value, agent_id, count in cursor.fetchall():
+            key = (value, agent_id)
+            counts[key] = counts.get(key, 0) + count
+        return counts
+
+    def get(self, column):
+        """ Returns {(value, agent_id): count} for the column. """
+        with self._lock:
+            state = self.tables.get(column)
+            # the entry is set again on every new hit, its own age decides
+            if state is None or time.time() - state[0] > self.timeout:
+                state = (time.time(), 0, dict(), None, dict())
+            built, settled, counts, tail_key, result = state
+            cursor = connection.cursor()
+            cursor.execute("SELECT max(id), count(*) FROM registry_hit WHERE id > %s", [settled])
+            key = cursor.fetchone()
+            if tuple(key) == tail_key:
+                return result
+            top = key[0] or settled
+            upto = max(settled, top - self.window)
+            if upto > settled:
+                counts = self._count(cursor, column, settled, upto, dict(counts))
+                settled = upto
+                # the hits above the new settled id are not known yet
+                tail_key = None
+            else:
+                tail_key = tuple(key)
+            result = self._count(cursor, column, settled, top, dict(counts))
+            self.tables.set(column, (built, settled, counts, tail_key, result))
+            logger.debug("Hits counted by %s (settled id %i, last id %i)" % (column, settled, top))
+            return result
+
+    def clear(self):
+        self.tables.clear()
+
+
+hit_counts = HitCounts(settings.REGISTRY_STATISTICS_RECOUNT, settings.REGISTRY_STATISTICS_RECOUNT_WINDOW)
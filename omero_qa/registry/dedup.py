@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+import logging
+import threading
+from datetime import date
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from omero_qa.registry.models import DailyHit
+
+logger = logging.getLogger('dedup-registry')
+
+
+class DailyDeduplication(object):
+    """
+    Only the first hit of the day from an address is logged for the
+    agents in agent_names. The (day, ip, agent) unique key of DailyHit
+    decides between the workers, the pairs already seen today by this
+    worker are remembered until midnight.
+    """
+
+    def __init__(self, agent_names):
+        self.agent_names = frozenset(agent_names)
+        self._day = None
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def applies_to(self, agent):
+        return agent.agent_name in self.agent_names
+
+    def first_today(self, ip, agent):
+        today = date.today()
+        key = (ip.id, agent.id)
+        with self._lock:
+            if self._day != today:
+                self._day = today
+                self._seen = set()
+            if key in self._seen:
+                return False
+            self._seen.add(key)
+
+        sid = transaction.savepoint()
+        try:
+            DailyHit(day=today, ip_id=ip.id, agent_id=agent.id).save(force_insert=True)
+            transaction.savepoint_commit(sid)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
+            return False
+        return True
+
+
+daily_dedup = DailyDeduplication(settings.REGISTRY_DAILY_DEDUP_AGENTS)
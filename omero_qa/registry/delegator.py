@@ -29,10 +29,16 @@ import time
 
 from django.conf import settings
 from django.db import models
+from django.db.models import Count
 from django.db import connection
 
-from omero_qa.qa.models import TestFile, TestEngineResult, FileFormat
-from omero_qa.registry.models import Hit, IP
+from omero_qa.qa.models import TestFile, TestEngineResult
+from omero_qa.registry import geohash
+from omero_qa.registry.models import Hit, IP, Continents
+from omero_qa.registry.counts import hit_counts
+from omero_qa.registry.hitqueue import hit_queue
+from omero_qa.registry.lru import LRUCache
+from omero_qa.registry.sessions import demo_sessions
 from datetime import datetime, date, timedelta
 
 logger = logging.getLogger('delegator-registry')
@@ -54,30 +60,150 @@ class IPforXML(models.Model):
     agent_name = models.CharField(max_length=250)
 
 
+MARKER_SQL = "SELECT DISTINCT registry_hit.ip_id, registry_ip.ip, registry_ip.latitude, registry_ip.longitude, registry_agent.display_name \
+        FROM registry_ip, registry_agent, registry_hit \
+        WHERE registry_hit.ip_id = registry_ip.id \
+        AND registry_hit.agent_id = registry_agent.id \
+        AND %s \
+        ORDER BY registry_hit.ip_id ASC"
+
+
+def marker_rows(continent=None, agent=None):
+    """
+    Runs the map query of a continent (1 for every continent) or of an
+    agent. Returns the cursor of the (ip_id, ip, latitude, longitude,
+    agent display name) rows ordered by ip_id, and for the continents
+    the (id, ip, latitude, longitude) of all its addresses, hit or not.
+    """
+    cursor = connection.cursor()
+    others = None
+    if continent is not None:
+        cont = Continents.objects.get(pk=continent)
+        logger.debug("N: '%s', S: '%s', W: '%s', E: '%s'" % (cont.n, cont.s, cont.w, cont.e))
+        if str(continent) == "1":
+            logger.debug("Every continents...")
+            others = IP.objects.exclude(latitude=None).exclude(longitude=None)
+            where = "(registry_ip.longitude is not null AND registry_ip.latitude is not null )"
+            params = []
+        else:
+            # geohash range scans, refined by the box
+            others = IP.objects.filter(geohash.bbox_q(cont.w, cont.s, cont.e, cont.n))\
+                                .filter(latitude__gte=cont.s, latitude__lte=cont.n,\
+                                        longitude__gte=cont.w, longitude__lte=cont.e).exclude(ip__startswith="10.")
+            where, params = geohash.bbox_sql("registry_ip.geohash", cont.w, cont.s, cont.e, cont.n)
+            where += " AND (registry_ip.longitude <= %s AND registry_ip.longitude >= %s \
+                AND registry_ip.latitude >= %s AND registry_ip.latitude <= %s )"
+            params += [cont.e, cont.w, cont.s, cont.n]
+        others = others.values_list('id', 'ip', 'latitude', 'longitude')
+    else:
+        logger.debug("Agent '%s' on every continents..." % agent)
+        where = "(registry_ip.longitude is not null AND registry_ip.latitude is not null ) \
+            AND registry_hit.agent_id = %s"
+        params = [agent]
+    cursor.execute(MARKER_SQL % where, params)
+    logger.debug("query executed")
+    return cursor, others
+
+
+def fetch_rows(cursor, size=1000):
+    """ Yields the rows of the cursor, size rows at a time. """
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        for row in rows:
+            yield row
+
+
+def iter_markers(rows, others=()):
+    """
+    Yields one (ip_id, ip, latitude, longitude, agent names) marker per
+    address of the (ip_id, ip, latitude, longitude, agent display name)
+    rows ordered by ip_id, the names of its agents joined, followed by
+    the (id, ip, latitude, longitude) of the other addresses which have
+    no hits, as "unknown". Only the ids seen are kept in memory.
+    """
+    seen = set()
+    marker = None
+    for ip_id, ip, latitude, longitude, agent_name in rows:
+        if marker is not None and marker[0] == ip_id:
+            marker[4] = "%s, %s" % (marker[4], agent_name)
+        else:
+            if marker is not None:
+                yield tuple(marker)
+            marker = [ip_id, ip, latitude, longitude, agent_name]
+            seen.add(ip_id)
+    if marker is not None:
+        yield tuple(marker)
+    for ip_id, ip, latitude, longitude in others:
+        if ip_id not in seen:
+            yield (ip_id, ip, latitude, longitude, "unknown")
+
+
+def build_markers(rows, others=()):
+    """ Returns the markers of iter_markers as IPforXML objects. """
+    return [IPforXML(id=ip_id, ip=ip, latitude=latitude, longitude=longitude, agent_name=agent_name)
+            for ip_id, ip, latitude, longitude, agent_name in iter_markers(rows, others)]
+
+
+_file_stat = LRUCache('file_stat', 1, settings.REGISTRY_FILE_STAT_TIMEOUT)
+
+
 def file_stat():
-    logger.debug("file stat")
-    formats = FileFormat.objects.all()
-    files = dict()
-    for f in formats:
-        c = TestFile.objects.filter(file_format=f).count()
-        if c > 0:
-            files[f.format_name] = c
-    logger.debug(files)
+    """ {format name: number of test files} in a single GROUP BY. """
+    files = _file_stat.get('files')
+    if files is None:
+        logger.debug("file stat")
+        rows = TestFile.objects.filter(file_format__isnull=False)\
+                    .values_list('file_format__format_name').annotate(count=Count('id'))
+        files = dict([(name, c) for name, c in rows if c > 0])
+        logger.debug(files)
+        _file_stat.set('files', files)
     return files
 
 
 def file_stat_percent():
     logger.debug("file stat percent")
-    formats = FileFormat.objects.all()
-    total = TestFile.objects.filter(file_format__isnull=False).count()
+    files = file_stat()
+    total = sum(files.values())
     logger.debug("Total %s" % str(total))
-    files = dict()
-    for f in formats:
-        c = TestFile.objects.filter(file_format=f).count()
-        if c > 0:
-            files[f.format_name] = 100*float(c)/float(total)
-    logger.debug(files)
-    return files
+    return dict([(name, 100*float(c)/float(total)) for name, c in files.items()])
+
+
+_results = LRUCache('results_summary', 1, settings.REGISTRY_FILE_STAT_TIMEOUT)
+
+
+def results_summary():
+    """
+    Returns the total_results of all time, of the current month and of
+    today as {'total': .., 'month': .., 'today': ..}, counted with one
+    query per table.
+    """
+    today = date.today()
+    summary = _results.get(today)
+    if summary is None:
+        day = datetime(today.year, today.month, today.day)
+        month = datetime(today.year, today.month, 1)
+        cursor = connection.cursor()
+        cursor.execute("SELECT count(*), \
+                sum(CASE WHEN upload_date >= %%s THEN 1 ELSE 0 END), \
+                sum(CASE WHEN upload_date >= %%s THEN 1 ELSE 0 END) \
+                FROM %s" % TestFile._meta.db_table, [month, day])
+        files = [c or 0 for c in cursor.fetchone()]
+        cursor.execute("SELECT count(*), \
+                sum(CASE WHEN started >= %%s THEN 1 ELSE 0 END), \
+                sum(CASE WHEN started >= %%s THEN 1 ELSE 0 END), \
+                sum(CASE WHEN error IS NOT NULL THEN 1 ELSE 0 END), \
+                sum(CASE WHEN error IS NOT NULL AND started >= %%s THEN 1 ELSE 0 END), \
+                sum(CASE WHEN error IS NOT NULL AND started >= %%s THEN 1 ELSE 0 END) \
+                FROM %s" % TestEngineResult._meta.db_table, [month, day, month, day])
+        results = [c or 0 for c in cursor.fetchone()]
+        summary = dict()
+        for i, key in enumerate(('total', 'month', 'today')):
+            summary[key] = {'files':files[i], 'results':results[i], 'failure':results[3+i]}
+        logger.debug("Results summary: %s" % summary)
+        _results.set(today, summary)
+    return summary
 
 
 def total_results():
@@ -109,7 +235,7 @@ def custom_date_results(custom_date=None):
     return {'files':files, 'results':results, 'failure':failure}
 
 
-def save_hit(ip, agent, agent_version=None, poll=None, os_name=None, os_arch=None, os_version=None, java_vendor=None, java_version=None, python_version=None, python_compiler=None, python_build=None, header=None):
+def save_hit(ip, agent, agent_version=None, poll=None, os_name=None, os_arch=None, os_version=None, java_vendor=None, java_version=None, python_version=None, python_compiler=None, python_build=None, header=None, headers_id=None):
     os_name = os_name is not None and os_name[:250] or None
     os_arch = os_arch is not None and os_arch[:250] or None
     os_version = os_version is not None and os_version[:250] or None
@@ -119,8 +245,11 @@ def save_hit(ip, agent, agent_version=None, poll=None, os_name=None, os_arch=Non
     python_compiler = python_compiler is not None and python_compiler[:50] or None
     python_build = python_build is not None and python_build[:50] or None
     
-    hit = Hit(ip=ip, agent=agent, agent_version=agent_version, poll=poll, os_name=os_name, os_arch=os_arch, os_version=os_version, java_vendor=java_vendor, java_version=java_version, python_version=python_version, python_compiler=python_compiler, python_build=python_build, header=header)
-    hit.save()
+    hit = Hit(ip=ip, agent=agent, agent_version=agent_version, poll=poll, os_name=os_name, os_arch=os_arch, os_version=os_version, java_vendor=java_vendor, java_version=java_version, python_version=python_version, python_compiler=python_compiler, python_build=python_build, header=header, headers_id=headers_id)
+    if settings.REGISTRY_HIT_WRITE_BEHIND:
+        hit_queue.put(hit)
+    else:
+        hit.save()
 
 class Statistics(object):
 
@@ -134,16 +263,42 @@ class Statistics(object):
         self.agents = agents
     
     
+    def _agent_names(self):
+        return dict([(a.id, a.display_name) for a in self.agents])
+    
+    
+    def _hits_by(self, column):
+        """
+        Counts the located hits grouped by the column and by agent,
+        returns (value, agent display name, count) rows. Only the hits
+        added since the previous report are counted, see registry.counts.
+        """
+        names = self._agent_names()
+        for (value, agent_id), count in hit_counts.get(column).iteritems():
+            if agent_id in names:
+                yield (value, names[agent_id], count)
+    
+    
+    def _rollups_by(self, column, since=None):
+        """
+        Same as _hits_by, read from the daily rollups of registry.rollup.
+        """
+        sql = "SELECT %s, agent_id, sum(hits) FROM registry_hitdailyrollup " % column
+        params = list()
+        if since is not None:
+            sql += "WHERE day >= %s "
+            params.append(since)
+        sql += "GROUP BY %s, agent_id" % column
+        
+        names = self._agent_names()
+        self.cursor.execute(sql, params)
+        for value, agent_id, count in self.cursor.fetchall():
+            if agent_id in names:
+                yield (value, names[agent_id], count)
+    
+    
     def last_30_days(self):
         start = date.today() + timedelta(days=-30)
-        sql = """SELECT date(registry_hit.creation_date), count(date(registry_hit.creation_date)) \
-                FROM registry_hit, registry_ip \
-                WHERE registry_hit.ip_id=registry_ip.id \
-                AND registry_ip.latitude IS NOT NULL \
-                AND registry_ip.longitude IS NOT NULL \
-                AND registry_hit.creation_date >= '%s' \
-                AND registry_hit.agent_id = %i \
-                GROUP BY date(registry_hit.creation_date) """
         
         total = 0
         table = dict()
@@ -153,13 +308,12 @@ class Statistics(object):
             for a in self.agents:
                 table[key][a.display_name]=0
 
-        for a in self.agents:
-            self.cursor.execute(sql % (start, a.id))
-            result = self.cursor.fetchall()
-            for res in result:
-                table[str(res[0])][a.display_name] = res[1]
-                table[str(res[0])]['Total'] += res[1]
-                total += res[1]
+        for day, name, count in self._rollups_by("day", start):
+            key = str(day)
+            if table.has_key(key):
+                table[key][name] += count
+                table[key]['Total'] += count
+                total += count
         
         keys = list(table)
         keys.sort()
@@ -176,38 +330,31 @@ class Statistics(object):
     
     def weekly(self, starting_year=2008):
         start = date(starting_year,1,1)
-        sql = """SELECT date(registry_hit.creation_date), count(date(registry_hit.creation_date)) \
-                FROM registry_hit, registry_ip \
-                WHERE registry_hit.ip_id=registry_ip.id \
-                AND registry_ip.latitude IS NOT NULL \
-                AND registry_ip.longitude IS NOT NULL \
-                AND registry_hit.creation_date >= '%s' \
-                AND registry_hit.agent_id = %i \
-                GROUP BY date(registry_hit.creation_date) """
         
         total = 0
         table = dict()
         diff = date.today() - start
-        weeks_range = divmod(diff.days, 7)[0]
         
-        for i in range(0, weeks_range+2):
-            week = i%53 < 10 and ("0%i" % (i%53)) or str(i%53)
-            key = "%s %s" % (str(starting_year + i/53), week)
-            table[key] = {'Total':0}
-            for a in self.agents:
-                table[key][a.display_name]=0
+        # every '%Y %W' week since the start, including the partial
+        # week 00 at the beginning of each year
+        for i in range(0, diff.days+1):
+            key = (start + timedelta(days=i)).strftime('%Y %W')
+            if not table.has_key(key):
+                table[key] = {'Total':0}
+                for a in self.agents:
+                    table[key][a.display_name]=0
 
-        for a in self.agents:
-            self.cursor.execute(sql % (start, a.id))
-            result = self.cursor.fetchall()
-            for res in result:
-                idx = res[0].strftime('%Y %W')
-                if table.has_key(idx):
-                    table[idx][a.display_name] += res[1]
-                    table[idx]['Total'] += res[1]
-                    total += res[1]
-                else:
-                    logger.info('Key %s does not exist' % idx)
+        for day, name, count in self._rollups_by("day", start):
+            if not isinstance(day, date):
+                # sqlite returns the date as a string
+                day = datetime.strptime(str(day), "%Y-%m-%d")
+            idx = day.strftime('%Y %W')
+            if table.has_key(idx):
+                table[idx][name] += count
+                table[idx]['Total'] += count
+                total += count
+            else:
+                logger.info('Key %s does not exist' % idx)
                     
         keys = list(table)
         keys.sort()
@@ -223,36 +370,21 @@ class Statistics(object):
     
     
     def by_country(self):
-        sql = """SELECT registry_ip.country, count(registry_hit.ip_id) \
-                FROM registry_hit, registry_ip \
-                WHERE registry_hit.ip_id=registry_ip.id \
-                AND registry_ip.latitude IS NOT NULL \
-                AND registry_ip.longitude IS NOT NULL \
-                AND registry_hit.agent_id = %i \
-                GROUP BY registry_ip.country """
-        
         total = 0
         table = {'Unknown': {'Total':0}}
         for a in self.agents:
             table['Unknown'][a.display_name] = 0
         
-        for a in self.agents:
-            self.cursor.execute(sql % a.id)
-            result = self.cursor.fetchall()
-            for res in result:
-                c = res[0]
-                if c is None:
-                    c = 'Unknown'
-                if table.has_key(c):
-                    table[c][a.display_name] += res[1]
-                    table[c]['Total'] += res[1]
-                else:
-                    table[c] = {'Total':0}
-                    for ag in self.agents:
-                        table[c][ag.display_name] = 0
-                    table[c][a.display_name] = res[1]
-                    table[c]['Total'] = res[1]
-                total += res[1]
+        for c, name, count in self._rollups_by("country"):
+            if c is None:
+                c = 'Unknown'
+            if not table.has_key(c):
+                table[c] = {'Total':0}
+                for ag in self.agents:
+                    table[c][ag.display_name] = 0
+            table[c][name] += count
+            table[c]['Total'] += count
+            total += count
         
         keys = list(table)
         keys.sort()
@@ -267,14 +399,6 @@ class Statistics(object):
     
     
     def by_ip(self):
-        sql = """SELECT registry_ip.ip, count(registry_hit.ip_id) \
-                FROM registry_hit, registry_ip \
-                WHERE registry_hit.ip_id=registry_ip.id \
-                AND registry_ip.latitude IS NOT NULL \
-                AND registry_ip.longitude IS NOT NULL \
-                AND registry_hit.agent_id = %i \
-                GROUP BY registry_ip.ip """
-        
         table = dict()
         total = 0
         total_table = dict()
@@ -282,21 +406,16 @@ class Statistics(object):
         for a in self.agents:
             total_table[a.display_name] = 0
             unique_table[a.display_name] = 0
-        for a in self.agents:            
-            self.cursor.execute(sql % a.id)
-            result = self.cursor.fetchall()
-            for res in result:
-                if table.has_key(res[0]):
-                    table[res[0]][a.display_name] += res[1]
-                    table[res[0]]['Total'] += res[1]
-                else:
-                    table[res[0]] = {'Total':res[1]} 
-                    for ag in self.agents:
-                        table[res[0]][ag.display_name] = 0
-                    table[res[0]][a.display_name] += res[1]
-                unique_table[a.display_name] += 1
-                total_table[a.display_name] += res[1]
-                total += res[1]
+        for ip, name, count in self._hits_by("registry_ip.ip"):
+            if not table.has_key(ip):
+                table[ip] = {'Total':0}
+                for ag in self.agents:
+                    table[ip][ag.display_name] = 0
+            table[ip][name] += count
+            table[ip]['Total'] += count
+            unique_table[name] += 1
+            total_table[name] += count
+            total += count
         
         keys = list(table)
         
@@ -323,13 +442,10 @@ class Statistics(object):
     
     
     def by_os(self):
-        sql = """SELECT registry_hit.os_name, count(registry_hit.os_name), \
-                registry_hit.os_arch, registry_hit.os_version \
-                FROM registry_hit, registry_ip \
-                WHERE registry_hit.ip_id=registry_ip.id \
-                AND registry_ip.latitude IS NOT NULL \
-                AND registry_ip.longitude IS NOT NULL \
-                GROUP BY registry_hit.os_name, registry_hit.os_arch, registry_hit.os_version """
+        sql = """SELECT os_name, sum(CASE WHEN os_name IS NULL THEN 0 ELSE hits END), \
+                os_arch, os_version \
+                FROM registry_hitdailyrollup \
+                GROUP BY os_name, os_arch, os_version """
         
         table = {'Others': 0}
         table_d = {'Others': 0}
@@ -372,16 +488,11 @@ class Statistics(object):
     
     
     def by_env(self):
-        sql = """SELECT registry_hit.java_version, count(registry_hit.java_version), \
-                registry_hit.java_vendor, \
-                registry_hit.python_version, count(registry_hit.python_version), \
-                registry_hit.python_compiler, registry_hit.python_build \
-                FROM registry_hit, registry_ip \
-                WHERE registry_hit.ip_id=registry_ip.id \
-                AND registry_ip.latitude IS NOT NULL \
-                AND registry_ip.longitude IS NOT NULL \
-                GROUP BY registry_hit.java_version, registry_hit.java_vendor, \
-                registry_hit.python_version, registry_hit.python_compiler, registry_hit.python_build """
+        sql = """SELECT java_version, sum(hits), java_vendor, \
+                python_version, sum(hits), python_compiler, python_build \
+                FROM registry_hitdailyrollup \
+                GROUP BY java_version, java_vendor, \
+                python_version, python_compiler, python_build """
         
         table_j = dict()
         table_p = dict()
@@ -429,10 +540,9 @@ class DemoStatistics(object):
     demo_group = None
     experimenters = dict()
     
-    def __init__(self):
-        ds = settings.DEMO_SERVER
-        self.conn = client_wrapper(ds['username'], ds['passwd'], host=ds['host'], port=ds['port'])
-        self.conn.connect()
+    def __init__(self, conn):
+        # a connection of registry.sessions.demo_sessions
+        self.conn = conn
         
         self.demo_group = self.conn.lookupGroup("demo_group") 
         self.experimenters = list()
@@ -440,9 +550,6 @@ class DemoStatistics(object):
             if e.omeName != 'root' and e.omeName != 'root_demo':
                 self.experimenters.append(e)
         
-    def ping(self):
-        self.conn.keepAlive()
-       
     def demostats(self):
         a = self.activities()
         f = self.formats()
@@ -453,36 +560,33 @@ class DemoStatistics(object):
         return result
     
     def formats(self):
+        # counted by the server, only the names of the images without
+        # a format are fetched to use their extension
         formats = dict()
         exp_formats = dict()
-        for e in self.experimenters:
-            p = omero.sys.Parameters()
-            p.map = {}
-            p.map["eid"] = rlong(e.id)
-            sql = "select i from Image as i " \
-                  "left outer join fetch i.format as f " \
-                  "where i.details.owner.id=:eid order by i.id asc"
-
-            res = self.conn.getQueryService().findAllByQuery(sql,p)
-            if len(res)>0:
-                exp_formats[e.id] = dict()
-                for r in res:
-                    if r.format is not None:
-                        k = r.format.value.val.lower()
-                    else:
-                        sp = r.name.val.rsplit(".")
-                        k = sp[len(sp)-1][:4].lower().strip()
-                                            
-                    #per exp
-                    if formats.has_key(k):
-                        formats[k]+=1
-                    else:
-                        formats[k] = 1
-
-                    if exp_formats[e.id].has_key(k):
-                        exp_formats[e.id][k]+=1
-                    else:
-                        exp_formats[e.id][k] = 1
+        if not self.experimenters:
+            return ([], [])
+        p = omero.sys.Parameters()
+        p.map = {}
+        p.map['eids'] = rlist(rlong(e.id) for e in self.experimenters)
+        qs = self.conn.getQueryService()
+        counted = unwrap(qs.projection("select i.details.owner.id, f.value, count(i.id) " \
+                                       "from Image as i join i.format as f " \
+                                       "where i.details.owner.id in (:eids) " \
+                                       "group by i.details.owner.id, f.value", p, None))
+        names = unwrap(qs.projection("select i.details.owner.id, i.name " \
+                                     "from Image as i " \
+                                     "where i.format is null and i.details.owner.id in (:eids)", p, None))
+        rows = [(eid, value.lower(), count) for eid, value, count in counted]
+        for eid, name in names:
+            sp = name.rsplit(".")
+            rows.append((eid, sp[len(sp)-1][:4].lower().strip(), 1))
+        
+        for eid, k, count in rows:
+            formats[k] = formats.get(k, 0) + count
+            if not exp_formats.has_key(eid):
+                exp_formats[eid] = dict()
+            exp_formats[eid][k] = exp_formats[eid].get(k, 0) + count
         
         keys = list(exp_formats)
         keys.sort()
@@ -558,3 +662,16 @@ class DemoStatistics(object):
                 result.append((e,t))
         logger.info('Statistics activities data (total: %i)' % (len(result)))
         return (result, agents)
+
+
+_demo_statistics = LRUCache('demo_statistics', 1, settings.REGISTRY_DEMO_STATISTICS_TIMEOUT)
+
+
+def demo_statistics():
+    """ DemoStatistics.demostats, recomputed every REGISTRY_DEMO_STATISTICS_TIMEOUT. """
+    result = _demo_statistics.get('demo')
+    if result is None:
+        with demo_sessions.session() as conn:
+            result = DemoStatistics(conn).demostats()
+        _demo_statistics.set('demo', result)
+    return result
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+''' Geohash of the registry addresses.
+
+IP.geohash is indexed, a bounding box is covered by a few geohash cells
+whose addresses are found with range scans of that index. The ranges
+only use the geohash alphabet, so they work with any collation on
+SQLite and PostgreSQL. The cells overlap the box, the exact latitude
+and longitude predicates still have to be applied.'''
+
+import math
+
+from django.db.models import Q
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# stored precision, about 5m
+PRECISION = 9
+
+# cells used to cover a bounding box at most
+MAX_CELLS = 32
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    """ Returns the geohash of the point. """
+    lat = [-90.0, 90.0]
+    lon = [-180.0, 180.0]
+    chars = list()
+    bit = 0
+    ch = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            rng, value = lon, longitude
+        else:
+            rng, value = lat, latitude
+        mid = (rng[0] + rng[1]) / 2
+        ch <<= 1
+        if value >= mid:
+            ch |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(BASE32[ch])
+            bit = 0
+            ch = 0
+    return "".join(chars)
+
+
+def cell_size(precision):
+    """ (width, height) in degrees of the cells at the precision. """
+    bits = 5 * precision
+    return (360.0 / 2 ** ((bits + 1) / 2), 180.0 / 2 ** (bits / 2))
+
+
+def _next(prefix):
+    """ The first geohash after every geohash starting with prefix. """
+    while prefix:
+        i = BASE32.index(prefix[-1])
+        if i < len(BASE32) - 1:
+            return prefix[:-1] + BASE32[i+1]
+        prefix = prefix[:-1]
+    return None
+
+
+def _cells(w, s, e, n):
+    for precision in range(PRECISION, 0, -1):
+        width, height = cell_size(precision)
+        x0, x1 = int(math.floor((w + 180) / width)), int(math.floor((e + 180) / width))
+        y0, y1 = int(math.floor((s + 90) / height)), int(math.floor((n + 90) / height))
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= MAX_CELLS or precision == 1:
+            break
+    xs = range(x0, x1 + 1)
+    ys = range(y0, y1 + 1)
+    cells = set()
+    for x in xs:
+        for y in ys:
+            lon = min(-180 + (x + 0.5) * width, 180)
+            lat = min(-90 + (y + 0.5) * height, 90)
+            cells.add(encode(lat, lon, precision))
+    return cells
+
+
+def bbox_ranges(w, s, e, n):
+    """
+    Returns the sorted (first, after) geohash ranges covering the box,
+    after is None for the end of the index. west > east across 180.
+    """
+    s = max(s, -90.0)
+    n = min(n, 90.0)
+    if w <= e:
+        cells = _cells(max(w, -180.0), s, min(e, 180.0), n)
+    else:
+        cells = _cells(w, s, 180.0, n) | _cells(-180.0, s, e, n)
+    # merge the adjacent ranges
+    ranges = list()
+    for prefix in sorted(cells):
+        after = _next(prefix)
+        if ranges and ranges[-1][1] == prefix:
+            ranges[-1] = (ranges[-1][0], after)
+        else:
+            ranges.append((prefix, after))
+    return ranges
+
+
+def bbox_q(w, s, e, n):
+    """ The IP filter of bbox_ranges. """
+    q = Q()
+    for first, after in bbox_ranges(w, s, e, n):
+        r = Q(geohash__gte=first)
+        if after is not None:
+            r &= Q(geohash__lt=after)
+        q |= r
+    return q
+
+
+def bbox_sql(column, w, s, e, n):
+    """ The (where clause, params) of bbox_ranges on the column. """
+    clauses = list()
+    params = list()
+    for first, after in bbox_ranges(w, s, e, n):
+        if after is not None:
+            clauses.append("(%s >= %%s AND %s < %%s)" % (column, column))
+            params.extend([first, after])
+        else:
+            clauses.append("%s >= %%s" % column)
+            params.append(first)
+    return "(%s)" % " OR ".join(clauses), params
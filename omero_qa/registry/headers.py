@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+''' Compact storage of the request headers of registry hits.
+
+Only the headers listed in settings.REGISTRY_HIT_HEADER_NAMES are kept,
+encoded as sorted "Name: value" lines. Identical sets are stored once in
+HitHeader and referenced from Hit.headers by their SHA-1.'''
+
+import re
+import hashlib
+import logging
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from omero_qa.registry.lru import LRUCache
+from omero_qa.registry.models import HitHeader
+
+logger = logging.getLogger('headers-registry')
+
+_ids = LRUCache('hit_header', settings.REGISTRY_HIT_HEADER_CACHE_SIZE)
+
+
+def header_name(key):
+    """ HTTP_USER_AGENT -> User-Agent """
+    if key.startswith('HTTP_'):
+        key = key[5:]
+    return "-".join([p.capitalize() for p in key.split("_")])
+
+
+def encode_headers(meta):
+    """
+    Returns the allow-listed headers of the WSGI environ as sorted
+    "Name: value" lines, or None if there are none.
+    """
+    lines = list()
+    for key in settings.REGISTRY_HIT_HEADER_NAMES:
+        value = meta.get(key)
+        if value is not None and value != "":
+            value = " ".join(str(value).split())
+            lines.append("%s: %s" % (header_name(key), value))
+    if not lines:
+        return None
+    lines.sort()
+    return "\n".join(lines)
+
+
+def get_header_id(encoded):
+    """
+    Returns the id of the HitHeader storing the encoded headers,
+    creating it if it does not exist yet.
+    """
+    if encoded is None:
+        return None
+    digest = hashlib.sha1(encoded).hexdigest()
+    hid = _ids.get(digest)
+    if hid is None:
+        try:
+            hid = HitHeader.objects.get(hash=digest).id
+        except HitHeader.DoesNotExist:
+            sid = transaction.savepoint()
+            try:
+                h = HitHeader(hash=digest, header=encoded)
+                h.save()
+                transaction.savepoint_commit(sid)
+                hid = h.id
+            except IntegrityError:
+                # created by another worker in the meantime
+                transaction.savepoint_rollback(sid)
+                hid = HitHeader.objects.get(hash=digest).id
+        _ids.set(digest, hid)
+    return hid
+
+
+# str(request.META) of the historical rows
+_REPR_VALUE = "'%s': (?:'((?:[^'\\\\]|\\\\.)*)'|\"((?:[^\"\\\\]|\\\\.)*)\")"
+
+def parse_meta_repr(header):
+    """
+    Returns the allow-listed headers found in the repr of a WSGI environ
+    as stored in Hit.header before the compact encoding.
+    """
+    meta = dict()
+    for key in settings.REGISTRY_HIT_HEADER_NAMES:
+        m = re.search(_REPR_VALUE % re.escape(key), header)
+        if m is not None:
+            value = m.group(1) is not None and m.group(1) or m.group(2)
+            meta[key] = value.decode('string_escape')
+    return meta
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+''' Write-behind queue for registry hits.
+
+hit() only appends a compact record to an in-memory batch and to the
+per-process spool file, a background thread then stores the batch with a
+single multi-row insert. The spool files left by dead processes are
+stored by the thread of the next worker, so hits are stored at least once
+after a crash of the process. The spool is not fsynced: a crash of the
+host loses the hits queued since the last flush.'''
+
+import os
+import glob
+import atexit
+import logging
+import threading
+import traceback
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection
+from django.utils import simplejson
+
+from omero_qa.registry.models import Hit
+
+logger = logging.getLogger('hitqueue-registry')
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def hit_to_record(hit):
+    record = dict()
+    for f in Hit._meta.local_fields:
+        if f.primary_key:
+            continue
+        value = getattr(hit, f.attname)
+        if isinstance(value, datetime):
+            value = value.strftime(DATE_FORMAT)
+        if value is not None:
+            record[f.attname] = value
+    return record
+
+
+def record_to_hit(record):
+    record = dict([(str(k), v) for k, v in record.items()])
+    if record.get('creation_date') is not None:
+        record['creation_date'] = datetime.strptime(record['creation_date'], DATE_FORMAT)
+    return Hit(**record)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+class HitQueue(object):
+    """
+    Batches hits in memory and stores them with bulk_create when
+    batch_size records are waiting or every flush_interval seconds.
+    """
+
+    def __init__(self, spool_dir, batch_size=500, flush_interval=5):
+        self.spool_dir = spool_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._records = list()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._spool = None
+        self._thread = None
+        self._stopped = False
+
+    def _spool_path(self, pid, suffix='spool'):
+        return os.path.join(self.spool_dir, "hits-%s.%s" % (pid, suffix))
+
+    def _start(self):
+        # FastCGI workers are forked from the parent which may have
+        # already used the queue, start over in every new process
+        self._pid = os.getpid()
+        self._records = list()
+        if not os.path.isdir(self.spool_dir):
+            os.makedirs(self.spool_dir)
+        self._spool = open(self._spool_path(self._pid), 'a')
+        self._thread = threading.Thread(target=self._run, name='hitqueue')
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info("Hit queue started in '%s'" % self._pid)
+
+    def put(self, hit):
+        line = simplejson.dumps(hit_to_record(hit), separators=(',', ':'))
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+            self._spool.write(line + "\n")
+            self._spool.flush()
+            self._records.append(line)
+            full = len(self._records) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def _run(self):
+        # the spools of the dead processes are stored out of the requests
+        try:
+            self.recover()
+        except:
+            logger.error(traceback.format_exc())
+        finally:
+            connection.close()
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except:
+                logger.error(traceback.format_exc())
+            finally:
+                connection.close()
+
+    def flush(self):
+        """ Stores every waiting record. """
+        with self._flush_lock:
+            with self._lock:
+                if not self._records:
+                    return 0
+                records = self._records
+                self._records = list()
+                # hand the spooled lines over to this flush, new hits
+                # go to a fresh spool file
+                self._spool.close()
+                flushing = self._spool_path(self._pid, 'flushing')
+                os.rename(self._spool_path(self._pid), flushing)
+                self._spool = open(self._spool_path(self._pid), 'a')
+            try:
+                self._store(records)
+            except:
+                # keep the records for the next flush
+                with self._lock:
+                    self._records = records + self._records
+                    for line in records:
+                        self._spool.write(line + "\n")
+                    self._spool.flush()
+                os.remove(flushing)
+                raise
+            os.remove(flushing)
+            return len(records)
+
+    def _store(self, lines):
+        Hit.objects.bulk_create([record_to_hit(simplejson.loads(l)) for l in lines],
+                                batch_size=self.batch_size)
+        logger.debug("%i hits stored" % len(lines))
+
+    def recover(self):
+        """
+        Stores the spool files left behind by dead processes.
+        """
+        paths = list()
+        for suffix in ('spool', 'flushing', 'recovering'):
+            paths.extend(glob.glob(os.path.join(self.spool_dir, "hits-*.%s" % suffix)))
+        for path in paths:
+            try:
+                pid = int(os.path.basename(path).split(".")[0].split("-")[1])
+            except ValueError:
+                continue
+            if pid == self._pid or _pid_alive(pid):
+                continue
+            claimed = self._spool_path(self._pid, 'recovering')
+            try:
+                # only one of the workers wins the rename
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            f = open(claimed)
+            try:
+                lines = [l for l in f.read().splitlines() if l.strip()]
+            finally:
+                f.close()
+            try:
+                self._store(lines)
+                logger.info("%i spooled hits recovered from '%s'" % (len(lines), path))
+                os.remove(claimed)
+            except:
+                logger.error(traceback.format_exc())
+                os.rename(claimed, path)
+
+    def close(self):
+        if self._pid == os.getpid():
+            self._stopped = True
+            self._wakeup.set()
+            self._thread.join()
+            try:
+                self.flush()
+            except:
+                logger.error(traceback.format_exc())
+
+
+hit_queue = HitQueue(settings.REGISTRY_HIT_SPOOL_DIR, settings.REGISTRY_HIT_BATCH_SIZE,
+                     settings.REGISTRY_HIT_FLUSH_INTERVAL)
+
+atexit.register(hit_queue.close)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+
+from omero_qa.geolocation import get_resolver
+from omero_qa.registry.lru import LRUCache
+from omero_qa.registry.models import IP
+
+logger = logging.getLogger('ipcache-registry')
+
+
+class IPCache(object):
+    """
+    Maps a client address to its registry_ip row as
+    (id, latitude, longitude, country) so that repeated pings from the
+    same site do not go to the database. Optionally backed by the shared
+    Django cache so that the other workers can reuse the resolution.
+    """
+
+    def __init__(self, maxsize, ttl, shared=False):
+        self.lru = LRUCache('ip', maxsize, ttl)
+        self.ttl = ttl
+        self.shared = shared
+
+    def _shared_key(self, addr):
+        return "registry_ip_%s" % addr
+
+    def _get(self, addr):
+        row = self.lru.get(addr)
+        if row is None and self.shared:
+            row = cache.get(self._shared_key(addr))
+            if row is not None:
+                self.lru.set(addr, row)
+        return row
+
+    def _set(self, addr, row):
+        self.lru.set(addr, row)
+        if self.shared:
+            cache.set(self._shared_key(addr), row, self.ttl)
+
+    def invalidate(self, addr):
+        self.lru.delete(addr)
+        if self.shared:
+            cache.delete(self._shared_key(addr))
+
+    def get_or_create(self, addr):
+        """
+        Returns the IP for the address, resolving and saving it
+        if it was never seen before. The returned instance is only
+        populated from the cache and must not be saved back.
+        """
+        row = self._get(addr)
+        if row is not None:
+            return IP(id=row[0], ip=addr, latitude=row[1], longitude=row[2], country=row[3])
+
+        try:
+            ip = IP.objects.get(ip=addr)
+        except IP.DoesNotExist:
+            latitude = None
+            longitude = None
+            geoip = get_resolver()
+            gir = geoip.record_by_addr(addr)
+            if gir is not None:
+                latitude = gir["latitude"]
+                longitude = gir["longitude"]
+            country = geoip.country_name_by_addr(addr)
+
+            logger.debug("IP: %s, latitude: '%s', longitude: '%s'" % (addr, latitude, longitude))
+            ip = IP(ip=addr, latitude=latitude, longitude=longitude, country=country)
+            ip.save()
+        self._set(addr, (ip.id, ip.latitude, ip.longitude, ip.country))
+        return ip
+
+    def stats(self):
+        return self.lru.stats()
+
+
+ip_cache = IPCache(settings.REGISTRY_IP_CACHE_SIZE, settings.REGISTRY_IP_CACHE_TIMEOUT,
+                   settings.REGISTRY_IP_CACHE_SHARED)
+
+
+def _invalidate_ip(sender, instance, **kwargs):
+    ip_cache.invalidate(instance.ip)
+
+post_save.connect(_invalidate_ip, sender=IP, dispatch_uid='registry_ipcache_save')
+post_delete.connect(_invalidate_ip, sender=IP, dispatch_uid='registry_ipcache_delete')
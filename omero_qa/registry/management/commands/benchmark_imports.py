@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+import os
+import sys
+import subprocess
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand, CommandError
+
+# run in a new interpreter, prints seconds, max RSS and whether
+# matplotlib was loaded
+IMPORT_SCRIPT = """
+import sys, time, resource
+start = time.time()
+import omero_qa.urls
+%s
+print time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, 'matplotlib' in sys.modules
+"""
+
+# what the registry views imported before the charts were loaded lazily
+EAGER_IMPORTS = """
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import numpy
+import matplotlib.pyplot
+from pylab import *
+"""
+
+
+class Command(NoArgsCommand):
+    help = "Compares the worker start-up cost of the URLconf with and without the eager matplotlib imports."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--repeat', type='int', dest='repeat', default=5,
+                    help='Number of interpreters started per case.'),
+    )
+
+    def _run(self, extra):
+        env = dict(os.environ)
+        env['DJANGO_SETTINGS_MODULE'] = os.environ.get('DJANGO_SETTINGS_MODULE', 'omero_qa.settings')
+        # no display on the workers
+        env.setdefault('MPLBACKEND', 'Agg')
+        p = subprocess.Popen([sys.executable, '-c', IMPORT_SCRIPT % extra], env=env,
+                             cwd=settings.BASE_DIR, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        if p.returncode != 0:
+            raise CommandError(err)
+        seconds, rss, loaded = out.split()[-3:]
+        return float(seconds), int(rss), loaded == 'True'
+
+    def handle_noargs(self, **options):
+        for name, extra in (('eager', EAGER_IMPORTS), ('lazy', '')):
+            runs = sorted([self._run(extra) for i in range(0, options['repeat'])])
+            seconds, rss, loaded = runs[len(runs)/2]
+            self.stdout.write("%s: %.3fs, max RSS %i kB, matplotlib loaded: %s\n" % (name, seconds, rss, loaded))
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+import random
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from omero_qa.registry.delegator import build_markers
+
+
+class Command(NoArgsCommand):
+    help = "Times the map marker builder on a synthetic registry (no database access)."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--ips', type='int', dest='ips', default=500000,
+                    help='Number of located addresses.'),
+        make_option('--hits', type='int', dest='hits', default=5000000,
+                    help='Number of hits.'),
+        make_option('--agents', type='int', dest='agents', default=4,
+                    help='Number of agents.'),
+        make_option('--seed', type='int', dest='seed', default=0,
+                    help='Seed of the synthetic data.'),
+    )
+
+    def handle_noargs(self, **options):
+        random.seed(options['seed'])
+        n_ips = options['ips']
+        agents = ["OMERO.agent%i" % i for i in range(0, options['agents'])]
+
+        self.stdout.write("Generating %i hits on %i addresses...\n" % (options['hits'], n_ips))
+        ips = [(i, "10.%i.%i.%i" % (i >> 16 & 255, i >> 8 & 255, i & 255),
+                random.uniform(-90, 90), random.uniform(-180, 180)) for i in range(1, n_ips+1)]
+        # a tenth of the addresses never hit, the low ids hit the most
+        active = n_ips - n_ips / 10
+        pairs = set()
+        for i in xrange(0, options['hits']):
+            ip_id = int(active * random.random() ** 2) + 1
+            pairs.add((ip_id, random.randint(0, len(agents)-1)))
+        # as returned by the SELECT DISTINCT ... ORDER BY ip_id
+        rows = [(ip_id,) + ips[ip_id-1][1:] + (agents[a],) for ip_id, a in sorted(pairs)]
+
+        start = time.time()
+        markers = build_markers(rows, iter(ips))
+        elapsed = time.time() - start
+        self.stdout.write("%i rows, %i markers built in %.3fs\n" % (len(rows), len(markers), elapsed))
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from omero_qa.registry.headers import encode_headers, get_header_id, parse_meta_repr
+from omero_qa.registry.models import Hit
+
+
+class Command(NoArgsCommand):
+    help = "Rewrites the str(request.META) headers of the registry hits into the compact shared form."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+                    help='Number of hits rewritten per transaction.'),
+    )
+
+    def handle_noargs(self, **options):
+        batch_size = options['batch_size']
+        verbosity = int(options.get('verbosity', 1))
+        last = 0
+        total = 0
+        while True:
+            rows = list(Hit.objects.filter(id__gt=last, header__isnull=False)
+                        .order_by('id').values_list('id', 'header')[:batch_size])
+            if not rows:
+                break
+            with transaction.commit_on_success():
+                by_header = dict()
+                for hid, header in rows:
+                    encoded = encode_headers(parse_meta_repr(header))
+                    by_header.setdefault(get_header_id(encoded), list()).append(hid)
+                for headers_id, ids in by_header.items():
+                    Hit.objects.filter(id__in=ids).update(headers=headers_id, header=None)
+            last = rows[-1][0]
+            total += len(rows)
+            if verbosity > 1:
+                self.stdout.write("%i hits rewritten (last id %i)\n" % (total, last))
+        if verbosity > 0:
+            self.stdout.write("%i hits rewritten\n" % total)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from omero_qa.registry import geohash
+from omero_qa.registry.models import IP
+
+
+class Command(NoArgsCommand):
+    help = "Sets the geohash of the located registry addresses which have none."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+                    help='Number of addresses updated per transaction.'),
+    )
+
+    def handle_noargs(self, **options):
+        batch_size = options['batch_size']
+        verbosity = int(options.get('verbosity', 1))
+        last = 0
+        total = 0
+        while True:
+            rows = list(IP.objects.filter(id__gt=last, geohash__isnull=True)
+                        .exclude(latitude=None).exclude(longitude=None)
+                        .order_by('id').values_list('id', 'latitude', 'longitude')[:batch_size])
+            if not rows:
+                break
+            with transaction.commit_on_success():
+                for ip_id, latitude, longitude in rows:
+                    IP.objects.filter(id=ip_id).update(geohash=geohash.encode(latitude, longitude))
+            last = rows[-1][0]
+            total += len(rows)
+            if verbosity > 1:
+                self.stdout.write("%i addresses updated (last id %i)\n" % (total, last))
+        if verbosity > 0:
+            self.stdout.write("%i addresses updated\n" % total)
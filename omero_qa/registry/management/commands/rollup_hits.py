@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from omero_qa.registry.rollup import hit_rollup
+
+
+class Command(NoArgsCommand):
+    help = "Folds the new registry hits into the daily rollups read by the statistics."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--rebuild', action='store_true', dest='rebuild', default=False,
+                    help='Recompute the rollups of every hit.'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        if options['rebuild']:
+            rows = hit_rollup.rebuild()
+            if verbosity > 0:
+                self.stdout.write("%i rollups rebuilt\n" % rows)
+        else:
+            count = hit_rollup.update()
+            if verbosity > 0:
+                self.stdout.write("%i new hits folded\n" % count)
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+from django.core.management.base import NoArgsCommand
+
+from omero_qa.registry.markers import marker_cache
+
+
+class Command(NoArgsCommand):
+    help = "Rebuilds the cached geomap markers of every continent and agent and their clusters."
+
+    def handle_noargs(self, **options):
+        built = marker_cache.warm()
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write("%i marker payloads built\n" % built)
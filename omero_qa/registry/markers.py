@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+''' Cache of the geomap XML markers of every continent and agent.
+
+The payloads are kept in the 'markers' cache and rebuilt ahead of their
+expiry by the warm_markers command or by the warmer thread. A new
+address only marks the continents containing it (and every continent)
+to be rebuilt, the previous payload is served until then.'''
+
+import os
+import time
+import atexit
+import logging
+import threading
+import traceback
+
+from django.conf import settings
+from django.core import serializers
+from django.core.cache import get_cache
+from django.db import connection
+from django.db.models.signals import post_save
+
+from omero_qa.registry.clusters import in_bbox, marker_clusters
+from omero_qa.registry.delegator import marker_rows, build_markers
+from omero_qa.registry.models import Agent, IP, Continents
+
+logger = logging.getLogger('markers-registry')
+
+# the continent of the whole map
+WORLD = 1
+
+# seconds a worker holds the rebuild of a payload
+BUILD_LEASE = 300
+
+
+def marker_key(continent=None, agent=None):
+    if continent is not None:
+        return "continent%s" % continent
+    return "agent%s" % agent
+
+
+def build_marker_xml(continent=None, agent=None):
+    cursor, others = marker_rows(continent=continent, agent=agent)
+    # the addresses without hits are added as "unknown"
+    ips = build_markers(cursor.fetchall(), others is not None and others.iterator() or ())
+    logger.debug("IPS: %s" % len(ips))
+    return serializers.serialize('xml', ips, fields=('latitude', 'longitude', 'agent_name'))
+
+
+class MarkerCache(object):
+    """
+    The marker payloads by continent or agent. With the warmer thread
+    enabled, the continents marked by invalidate are rebuilt every delay
+    seconds and one of the workers rebuilds all of them and the marker
+    clusters every interval seconds, so that they are not built within a
+    request. A continent is rebuilt by one worker at a time, the world
+    at most once every world_delay seconds.
+    """
+
+    def __init__(self, timeout, interval, delay, world_delay, warmer=False):
+        self.timeout = timeout
+        self.interval = interval
+        self.delay = delay
+        self.world_delay = world_delay
+        self.warmer = warmer
+        self._continents = None
+        self._points = list()
+        self._dirty = dict()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._thread = None
+        self._stopped = False
+        self._warmed = 0
+
+    @property
+    def cache(self):
+        return get_cache('markers')
+
+    def continents(self):
+        """ [(id, bbox)] of the continents, loaded again by warm. """
+        if self._continents is None:
+            self._continents = [(c.id, (c.w, c.s, c.e, c.n)) for c in Continents.objects.all()]
+        return self._continents
+
+    def containing(self, latitude, longitude):
+        return set([cont for cont, bbox in self.continents()
+                    if cont == WORLD or in_bbox(latitude, longitude, bbox)])
+
+    def get(self, continent=None, agent=None):
+        """ Returns the XML payload, built now if it is not cached. """
+        if self.warmer:
+            self._start()
+        key = marker_key(continent, agent)
+        data = self.cache.get(key)
+        if data is None:
+            logger.info("XML data for '%s' not cached" % key)
+            data = self.build(continent, agent)
+        return data
+
+    def build(self, continent=None, agent=None):
+        key = marker_key(continent, agent)
+        started = time.time()
+        data = build_marker_xml(continent, agent)
+        self.cache.set(key, data, self.timeout)
+        self.cache.set(key + ':built', started, self.timeout)
+        return data
+
+    def warm(self):
+        """
+        Rebuilds every continent and agent and the clusters of every zoom
+        level, returns the number of payloads built.
+        """
+        marker_clusters.build()
+        self._continents = None
+        built = 0
+        for cont, bbox in self.continents():
+            self.build(continent=cont)
+            built += 1
+        for agent in Agent.objects.all():
+            self.build(agent=agent.id)
+            built += 1
+        self._warmed = time.time()
+        logger.info("%i marker payloads warmed" % built)
+        return built
+
+    def invalidate(self, latitude, longitude):
+        """
+        Marks the point for the continents containing it to be rebuilt by
+        the warmer thread, or drops them straight away without it.
+        """
+        if self.warmer:
+            self._start()
+            with self._lock:
+                self._points.append((latitude, longitude, time.time()))
+        else:
+            for cont in self.containing(latitude, longitude):
+                self.cache.delete(marker_key(continent=cont))
+
+    def rebuild(self, continent, marked):
+        """
+        Rebuilds the continent unless it was built after marked, returns
+        False if it is left for later.
+        """
+        key = marker_key(continent=continent)
+        built = self.cache.get(key + ':built')
+        if built is not None:
+            if built >= marked:
+                return True
+            if continent == WORLD and time.time() - built < self.world_delay:
+                return False
+        # one worker at a time, the others check again on their next round
+        if not self.cache.add(key + ':lock', self._pid, BUILD_LEASE):
+            return False
+        try:
+            self.build(continent=continent)
+        finally:
+            self.cache.delete(key + ':lock')
+        return True
+
+    def rebuild_dirty(self):
+        """ Rebuilds the continents of the points marked by invalidate. """
+        with self._lock:
+            points, self._points = self._points, list()
+        for latitude, longitude, marked in points:
+            for cont in self.containing(latitude, longitude):
+                # the earliest mark not rebuilt yet
+                self._dirty.setdefault(cont, marked)
+        for cont, marked in self._dirty.items():
+            if self.rebuild(cont, marked):
+                del self._dirty[cont]
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # forked workers start their own thread
+            self._pid = os.getpid()
+            self._points = list()
+            self._dirty = dict()
+            self._thread = threading.Thread(target=self._run, name='markers')
+            self._thread.daemon = True
+            self._thread.start()
+            logger.info("Marker warmer started in '%s'" % self._pid)
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.delay)
+            self._wakeup.clear()
+            try:
+                if time.time() - self._warmed > self.interval:
+                    self._warmed = time.time()
+                    # a single worker warms every interval
+                    if self.cache.add('markers_warm', self._pid, self.interval):
+                        self.warm()
+                self.rebuild_dirty()
+            except:
+                logger.error(traceback.format_exc())
+            finally:
+                connection.close()
+
+    def close(self):
+        if self._pid == os.getpid():
+            self._stopped = True
+            self._wakeup.set()
+            self._thread.join()
+
+
+marker_cache = MarkerCache(settings.CACHE_TIMEOUT, settings.REGISTRY_MARKER_WARM_INTERVAL,
+                           settings.REGISTRY_MARKER_REBUILD_DELAY, settings.REGISTRY_MARKER_WORLD_DELAY,
+                           settings.REGISTRY_MARKER_WARMER)
+
+atexit.register(marker_cache.close)
+
+
+def _invalidate_markers(sender, instance, created, **kwargs):
+    if created and instance.latitude is not None and instance.longitude is not None:
+        marker_cache.invalidate(instance.latitude, instance.longitude)
+
+post_save.connect(_invalidate_markers, sender=IP, dispatch_uid='registry_ip_markers')
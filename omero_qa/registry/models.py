@@ -29,6 +29,8 @@ from django import forms
 from django.forms import ModelForm
 from django.conf import settings
 
+from omero_qa.registry import geohash
+
 ### MODELS ###
 
 class Version(models.Model):
@@ -70,17 +72,38 @@ class IP(models.Model):
     latitude = models.FloatField(blank=True, null=True)
     longitude = models.FloatField(blank=True, null=True)
     country = models.CharField(max_length=250, blank=True, null=True)
+    geohash = models.CharField(max_length=12, blank=True, null=True, db_index=True)
+    
+    def save(self, *args, **kwargs):
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = geohash.encode(self.latitude, self.longitude)
+        else:
+            self.geohash = None
+        super(IP, self).save(*args, **kwargs)
     
     def __unicode__(self):
         c = "%s" % (self.ip)
         return c
 
+
+
+class HitHeader(models.Model):
+    """
+    Distinct set of allow-listed request headers shared by the hits,
+    see registry.headers
+    """
+    hash = models.CharField(max_length=40, unique=True)
+    header = models.TextField()
+
+    def __unicode__(self):
+        return self.header
+
         
 class Hit(models.Model):
      
     ip = models.ForeignKey(IP)
     poll = models.IntegerField(blank=True, null=True)
-    creation_date = models.DateTimeField(default=datetime.now)
+    creation_date = models.DateTimeField(default=datetime.now, db_index=True)
     agent = models.ForeignKey(Agent)
     agent_version = models.CharField(max_length=250, blank=True, null=True)
     os_name = models.CharField(max_length=250, blank=True, null=True)
@@ -92,12 +115,62 @@ class Hit(models.Model):
     python_compiler = models.CharField(max_length=50, blank=True, null=True)
     python_build = models.CharField(max_length=50, blank=True, null=True)
     header = models.TextField(blank=True, null=True)
+    headers = models.ForeignKey(HitHeader, blank=True, null=True)
     
     def __unicode__(self):
         c = "%s %s: %s" % (self.ip, self.agent.agent_name, self.agent_version)
         return c
 
 
+class HitDailyRollup(models.Model):
+    """
+    Located hits and distinct addresses per day, agent, country, OS and
+    environment, maintained from the new hits by registry.rollup
+    """
+    day = models.DateField(db_index=True)
+    agent = models.ForeignKey(Agent)
+    country = models.CharField(max_length=250, blank=True, null=True)
+    os_name = models.CharField(max_length=250, blank=True, null=True)
+    os_arch = models.CharField(max_length=250, blank=True, null=True)
+    os_version = models.CharField(max_length=250, blank=True, null=True)
+    java_vendor = models.CharField(max_length=250, blank=True, null=True)
+    java_version = models.CharField(max_length=250, blank=True, null=True)
+    python_version = models.CharField(max_length=50, blank=True, null=True)
+    python_compiler = models.CharField(max_length=50, blank=True, null=True)
+    python_build = models.CharField(max_length=50, blank=True, null=True)
+    hits = models.IntegerField()
+    ips = models.IntegerField()
+
+    def __unicode__(self):
+        c = "%s %s: %i" % (self.day, self.agent.agent_name, self.hits)
+        return c
+
+
+class HitRollupState(models.Model):
+    """ Last registry_hit id folded into the rollups """
+    last_hit_id = models.IntegerField(default=0)
+
+    def __unicode__(self):
+        return str(self.last_hit_id)
+
+
+class DailyHit(models.Model):
+    """
+    First hit of the day by the agents which are only counted once
+    a day, see registry.dedup
+    """
+    day = models.DateField()
+    ip = models.ForeignKey(IP)
+    agent = models.ForeignKey(Agent)
+
+    class Meta:
+        unique_together = (('day', 'ip', 'agent'),)
+
+    def __unicode__(self):
+        c = "%s %s: %s" % (self.day, self.ip, self.agent.agent_name)
+        return c
+
+
 class Continents(models.Model):
     continent_name = models.CharField(max_length=20)
     n = models.FloatField()
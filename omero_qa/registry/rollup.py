@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+''' Daily rollups of the located registry hits.
+
+registry_hitdailyrollup holds the number of hits and of distinct addresses
+per day, agent, country, OS and environment. Only the days which received
+hits since the last run (registry_hitrollupstate) are recomputed, so the
+statistics read a table bounded by days x dimensions instead of every hit.'''
+
+import time
+import logging
+import threading
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from omero_qa.registry.models import HitDailyRollup, HitRollupState
+
+logger = logging.getLogger('rollup-registry')
+
+DIMENSIONS = ('os_name', 'os_arch', 'os_version', 'java_vendor', 'java_version',
+              'python_version', 'python_compiler', 'python_build')
+
+ROLLUP_SQL = """INSERT INTO registry_hitdailyrollup \
+        (day, agent_id, country, %(columns)s, hits, ips) \
+        SELECT date(registry_hit.creation_date), registry_hit.agent_id, \
+        registry_ip.country, %(hit_columns)s, count(*), count(DISTINCT registry_hit.ip_id) \
+        FROM registry_hit, registry_ip \
+        WHERE registry_hit.ip_id=registry_ip.id \
+        AND registry_ip.latitude IS NOT NULL \
+        AND registry_ip.longitude IS NOT NULL \
+        AND registry_hit.creation_date >= %%s \
+        AND registry_hit.id <= %%s \
+        GROUP BY date(registry_hit.creation_date), registry_hit.agent_id, \
+        registry_ip.country, %(hit_columns)s""" % {
+    'columns': ", ".join(DIMENSIONS),
+    'hit_columns': ", ".join(["registry_hit.%s" % d for d in DIMENSIONS])}
+
+
+class HitRollup(object):
+    """
+    Folds the new registry hits into the daily rollups. Every day touched
+    by a hit newer than the recorded id is recomputed as a whole, as the
+    distinct address counts cannot be added up.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._refreshed = 0
+        self._lock = threading.Lock()
+
+    def _state(self):
+        try:
+            return HitRollupState.objects.select_for_update().get(pk=1)
+        except HitRollupState.DoesNotExist:
+            state = HitRollupState(pk=1, last_hit_id=0)
+            state.save(force_insert=True)
+            return state
+
+    def _fold(self, cursor, since, last_id):
+        start = datetime(since.year, since.month, since.day)
+        HitDailyRollup.objects.filter(day__gte=start.date()).delete()
+        cursor.execute(ROLLUP_SQL, [start, last_id])
+
+    def update(self):
+        """ Returns the number of new hits folded into the rollups. """
+        cursor = connection.cursor()
+        with transaction.commit_on_success():
+            state = self._state()
+            cursor.execute("SELECT max(id) FROM registry_hit")
+            top = cursor.fetchone()[0]
+            if top is None or top <= state.last_hit_id:
+                return 0
+            cursor.execute("SELECT min(creation_date), count(*) FROM registry_hit \
+                    WHERE id > %s AND id <= %s", [state.last_hit_id, top])
+            since, count = cursor.fetchone()
+            if isinstance(since, basestring):
+                # sqlite returns the timestamp as a string
+                since = datetime.strptime(since[:10], "%Y-%m-%d")
+            self._fold(cursor, since, top)
+            state.last_hit_id = top
+            state.save()
+        logger.info("%i hits folded into the rollups since %s" % (count, since))
+        return count
+
+    def rebuild(self):
+        """ Recomputes every rollup, returns the number of rollup rows. """
+        cursor = connection.cursor()
+        with transaction.commit_on_success():
+            state = self._state()
+            cursor.execute("SELECT max(id), min(creation_date) FROM registry_hit")
+            top, since = cursor.fetchone()
+            HitDailyRollup.objects.all().delete()
+            if top is not None:
+                if isinstance(since, basestring):
+                    since = datetime.strptime(since[:10], "%Y-%m-%d")
+                self._fold(cursor, since, top)
+            state.last_hit_id = top or 0
+            state.save()
+        rows = HitDailyRollup.objects.count()
+        logger.info("%i rollups rebuilt" % rows)
+        return rows
+
+    def refresh(self):
+        """ Brings the rollups up to date at most every interval seconds. """
+        if time.time() - self._refreshed < self.interval:
+            return
+        with self._lock:
+            if time.time() - self._refreshed < self.interval:
+                return
+            self.update()
+            self._refreshed = time.time()
+
+
+hit_rollup = HitRollup(settings.REGISTRY_ROLLUP_INTERVAL)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+''' Pool of OMERO sessions of the demo server.
+
+A worker borrows a connection for the time of a request with session().
+The idle connections are kept alive by a thread of the worker, a
+connection found dead is closed and replaced by a new one. The number of
+connections of a worker is bounded, a request waits for one at most
+wait seconds.'''
+
+import os
+import time
+import atexit
+import logging
+import threading
+import traceback
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger('sessions-registry')
+
+
+class SessionPoolError(Exception):
+    pass
+
+
+class OmeroConnector(object):
+    """ Opens client_wrapper connections to the server of the setting. """
+
+    def __init__(self, setting):
+        self.setting = setting
+
+    def connect(self):
+        from omero import client_wrapper
+        ds = getattr(settings, self.setting)
+        conn = client_wrapper(ds['username'], ds['passwd'], host=ds['host'], port=ds['port'])
+        if not conn.connect():
+            raise SessionPoolError("Cannot connect to '%s:%s'" % (ds['host'], ds['port']))
+        return conn
+
+
+class StubConnection(object):
+    """ A connection of StubConnector, dies when kill is called. """
+
+    def __init__(self, connector, id):
+        self.connector = connector
+        self.id = id
+        self.alive = True
+        self.closed = False
+
+    def keepAlive(self):
+        self.connector.pings += 1
+        return self.alive
+
+    def kill(self):
+        self.alive = False
+
+    def seppuku(self):
+        self.closed = True
+
+
+class StubConnector(object):
+    """ Local connector for the tests, no server involved. """
+
+    def __init__(self):
+        self.connections = list()
+        self.pings = 0
+        self.down = False
+
+    def connect(self):
+        if self.down:
+            raise SessionPoolError("Stub server down")
+        conn = StubConnection(self, len(self.connections) + 1)
+        self.connections.append(conn)
+        return conn
+
+
+def _alive(conn):
+    try:
+        return bool(conn.keepAlive())
+    except Exception:
+        logger.debug(traceback.format_exc())
+        return False
+
+
+def _close(conn):
+    try:
+        conn.seppuku()
+    except Exception:
+        logger.debug(traceback.format_exc())
+
+
+class SessionPool(object):
+    """
+    At most size connections of connector per process. The idle ones
+    unused for keepalive seconds are pinged by the keep-alive thread and
+    checked again before being handed out.
+    """
+
+    def __init__(self, connector, size, keepalive, wait):
+        self.connector = connector
+        self.size = size
+        self.keepalive = keepalive
+        self.wait = wait
+        self._idle = list()
+        self._open = 0
+        self._cond = threading.Condition()
+        self._pid = None
+        self._thread = None
+        self._stopped = False
+        self._wakeup = threading.Event()
+
+    def _start(self):
+        if self._pid == os.getpid():
+            return
+        # forked workers do not share the connections of the parent
+        self._pid = os.getpid()
+        self._idle = list()
+        self._open = 0
+        if self.keepalive:
+            self._thread = threading.Thread(target=self._run, name='sessions')
+            self._thread.daemon = True
+            self._thread.start()
+        logger.info("Session pool started in '%s'" % self._pid)
+
+    def _connect(self):
+        try:
+            conn = self.connector.connect()
+        except:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        logger.debug("New session (%i open)" % self._open)
+        return conn
+
+    def acquire(self):
+        """ Returns a live connection, see release. """
+        with self._cond:
+            self._start()
+            deadline = time.time() + self.wait
+            while not self._idle and self._open >= self.size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise SessionPoolError("No session available after %is" % self.wait)
+                self._cond.wait(remaining)
+            if self._idle:
+                conn, used = self._idle.pop()
+            else:
+                self._open += 1
+                conn = used = None
+        if conn is None:
+            return self._connect()
+        if time.time() - used >= self.keepalive and not _alive(conn):
+            logger.info("Dead session replaced")
+            _close(conn)
+            return self._connect()
+        return conn
+
+    def release(self, conn, check=False):
+        """ Gives the connection back, closed if check finds it dead. """
+        if check and not _alive(conn):
+            self.discard(conn)
+            return
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._idle.append((conn, time.time()))
+            self._cond.notify()
+
+    def discard(self, conn):
+        _close(conn)
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._open -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def session(self):
+        """
+        with pool.session() as conn: ... the connection is checked before
+        going back to the pool if the block raised.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        except:
+            self.release(conn, check=True)
+            raise
+        self.release(conn)
+
+    def ping(self):
+        """ Pings the connections idle for keepalive seconds. """
+        now = time.time()
+        with self._cond:
+            stale = [i for i in self._idle if now - i[1] >= self.keepalive]
+            self._idle = [i for i in self._idle if now - i[1] < self.keepalive]
+        for conn, used in stale:
+            self.release(conn, check=True)
+        return len(stale)
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.keepalive)
+            try:
+                self.ping()
+            except:
+                logger.error(traceback.format_exc())
+
+    def close(self):
+        if self._pid != os.getpid():
+            return
+        self._stopped = True
+        self._wakeup.set()
+        with self._cond:
+            idle, self._idle = self._idle, list()
+            self._open -= len(idle)
+        for conn, used in idle:
+            _close(conn)
+
+
+demo_sessions = SessionPool(OmeroConnector('DEMO_SERVER'), settings.REGISTRY_DEMO_SESSIONS,
+                            settings.REGISTRY_DEMO_KEEPALIVE, settings.REGISTRY_DEMO_WAIT)
+
+atexit.register(demo_sessions.close)
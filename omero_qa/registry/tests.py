@@ -1,18 +1,42 @@
+import os
 import platform
+import shutil
+import tempfile
 import time
+from datetime import datetime, timedelta
 
 from django.test import TestCase
 from django.test import Client
 from django.core.urlresolvers import reverse
 
 from django.core.management import call_command
+from django.core.cache import get_cache
 
 from django.conf import settings
 
 from django.test.client import RequestFactory
+from django.utils import simplejson
 
+from omero_qa.geolocation import GeoIPDatabase, get_resolver
+from omero_qa.registry.agents import agent_registry
+from omero_qa.registry.charts import chart_cache, pie_chart
+from omero_qa.registry.clusters import marker_clusters
+from omero_qa.registry.counts import hit_counts
+from omero_qa.registry.delegator import Statistics, build_markers, file_stat, file_stat_percent, _file_stat, \
+     results_summary, total_results, custom_date_results, _results
+from omero_qa.qa.models import FileFormat, TestFile, TestEngineResult
+from omero_qa.registry.dedup import daily_dedup
+from omero_qa.registry import geohash
+from omero_qa.registry.headers import encode_headers, get_header_id
+from omero_qa.registry.hitqueue import HitQueue, hit_to_record
+from omero_qa.registry.ipcache import ip_cache
+from omero_qa.registry.lru import LRUCache
+from omero_qa.registry.markers import marker_cache, marker_key
+from omero_qa.registry.rollup import hit_rollup
+from omero_qa.registry.sessions import SessionPool, SessionPoolError, StubConnector
+from omero_qa.registry.versions import parse_version, version_policy
 from omero_qa.registry.views import hit as views_hit
-from omero_qa.registry.models import Agent, IP, Hit, Continents, Version
+from omero_qa.registry.models import Agent, IP, Hit, HitHeader, HitDailyRollup, DailyHit, Continents, Version
 
 
 def getOSVersion():
@@ -34,6 +58,7 @@ class RegistryTestCase(TestCase):
         Agent.objects.create(agent_name="OMERO.test",
                              display_name="OMERO.test")
         self.factory = RequestFactory()
+        ip_cache.lru.clear()
 
     def test_empty_hit(self):
         hit_url = reverse('registry_hit')
@@ -116,3 +141,684 @@ class RegistryTestCase(TestCase):
         self.assertEqual(hit.python_compiler, data["python.compiler"][:50])
         self.assertEqual(hit.python_build, data["python.build"][1])
 
+
+class GeoIPResolverTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'GeoIP.dat')
+        shutil.copy(settings.GEOIP, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_shared_resolver(self):
+        self.assertTrue(get_resolver() is get_resolver())
+
+    def test_reader_is_reused(self):
+        db = GeoIPDatabase(self.path, check_interval=3600)
+        db.lookup('country_name_by_addr', '8.8.8.8')
+        reader = db._reader
+        db.lookup('country_name_by_addr', '8.8.4.4')
+        self.assertTrue(db._reader is reader)
+
+    def test_reload_on_change(self):
+        db = GeoIPDatabase(self.path, check_interval=0)
+        db.lookup('country_name_by_addr', '8.8.8.8')
+        reader = db._reader
+        mtime = os.stat(self.path).st_mtime
+        os.utime(self.path, (mtime + 10, mtime + 10))
+        db.lookup('country_name_by_addr', '8.8.8.8')
+        self.assertFalse(db._reader is reader)
+
+
+class IPCacheTestCase(TestCase):
+
+    def setUp(self):
+        ip_cache.lru.clear()
+
+    def test_lru_eviction(self):
+        lru = LRUCache('test', maxsize=2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(lru.get('a'), 1)
+        lru.set('c', 3)
+        self.assertEqual(lru.get('b'), None)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.get('c'), 3)
+        stats = lru.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']),
+                         (3, 1, 1))
+
+    def test_lru_ttl(self):
+        lru = LRUCache('test', maxsize=2, ttl=-1)
+        lru.set('a', 1)
+        self.assertEqual(lru.get('a'), None)
+
+    def test_repeated_address(self):
+        ip = ip_cache.get_or_create('10.0.0.1')
+        self.assertEqual(IP.objects.filter(ip='10.0.0.1').count(), 1)
+        with self.assertNumQueries(0):
+            cached = ip_cache.get_or_create('10.0.0.1')
+        self.assertEqual(cached.id, ip.id)
+        self.assertEqual(cached.country, ip.country)
+
+
+class HitQueueTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.queue = HitQueue(self.tmpdir, batch_size=100, flush_interval=3600)
+        self.ip = IP.objects.create(ip='10.0.0.1')
+        self.agent = Agent.objects.create(agent_name="OMERO.test",
+                                          display_name="OMERO.test")
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_flush(self):
+        self.queue.put(Hit(ip=self.ip, agent=self.agent, agent_version='5.1.0'))
+        self.queue.put(Hit(ip=self.ip, agent=self.agent, agent_version='5.1.1'))
+        self.assertEqual(Hit.objects.count(), 0)
+        self.assertEqual(self.queue.flush(), 2)
+        self.assertEqual(
+            sorted(Hit.objects.values_list('agent_version', flat=True)),
+            ['5.1.0', '5.1.1'])
+        self.assertEqual(self.queue.flush(), 0)
+
+    def test_recover_spool(self):
+        from django.utils import simplejson
+        hit = Hit(ip=self.ip, agent=self.agent, agent_version='5.1.0')
+        # a pid which cannot be running
+        spool = open(os.path.join(self.tmpdir, 'hits-%i.spool' % (2 ** 22 + 1)), 'w')
+        spool.write(simplejson.dumps(hit_to_record(hit)) + "\n")
+        spool.close()
+        self.queue.recover()
+        hit = Hit.objects.get()
+        self.assertEqual(hit.agent_version, '5.1.0')
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_recover_in_thread(self):
+        import threading
+        threads = list()
+        self.queue.recover = lambda: threads.append(threading.current_thread().name)
+        self.queue.put(Hit(ip=self.ip, agent=self.agent, agent_version='5.1.0'))
+        self.queue.close()
+        self.assertEqual(threads, ['hitqueue'])
+
+
+class VersionPolicyTestCase(TestCase):
+
+    def setUp(self):
+        Version.objects.create(version="4.10.1")
+
+    def test_parse_version(self):
+        self.assertEqual(parse_version("OMERO-5.1.2-ice35-b40"), (5, 1, 2))
+        self.assertEqual(parse_version("5.1"), (5, 1, 0))
+        self.assertEqual(parse_version("unknown"), None)
+
+    def test_needs_upgrade(self):
+        self.assertTrue(version_policy.needs_upgrade("4.9.3"))
+        self.assertTrue(version_policy.needs_upgrade("4.10.0"))
+        self.assertTrue(version_policy.needs_upgrade(None))
+        self.assertTrue(version_policy.needs_upgrade("foo"))
+        self.assertFalse(version_policy.needs_upgrade("4.10.1"))
+        self.assertFalse(version_policy.needs_upgrade("OMERO-5.0.0-ice34"))
+
+    def test_no_queries(self):
+        version_policy.current()
+        with self.assertNumQueries(0):
+            version_policy.needs_upgrade("4.9.3")
+
+    def test_invalidate_on_save(self):
+        version_policy.current()
+        ver = Version.objects.get(pk=1)
+        ver.version = "5.0.0"
+        ver.save()
+        self.assertTrue(version_policy.needs_upgrade("4.10.1"))
+
+
+class HitHeaderTestCase(TestCase):
+
+    def test_encode_headers(self):
+        meta = {'HTTP_USER_AGENT': 'OMERO.test', 'REMOTE_ADDR': '10.0.0.1',
+                'HTTP_ACCEPT_ENCODING': 'gzip,  deflate', 'wsgi.input': object()}
+        self.assertEqual(encode_headers(meta),
+                         "Accept-Encoding: gzip, deflate\nUser-Agent: OMERO.test")
+
+    def test_shared_headers(self):
+        encoded = encode_headers({'HTTP_USER_AGENT': 'OMERO.test'})
+        hid = get_header_id(encoded)
+        self.assertEqual(get_header_id(encoded), hid)
+        self.assertEqual(HitHeader.objects.count(), 1)
+
+    def test_compact_historical_headers(self):
+        ip = IP.objects.create(ip='10.0.0.1')
+        agent = Agent.objects.create(agent_name="OMERO.test",
+                                     display_name="OMERO.test")
+        header = str({'HTTP_USER_AGENT': "OMERO.test", 'REMOTE_ADDR': '10.0.0.1',
+                      'HTTP_VIA': "1.1 proxy's", 'wsgi.errors': object()})
+        for i in range(3):
+            Hit.objects.create(ip=ip, agent=agent, header=header)
+        call_command('compact_hit_headers', batch_size=2, verbosity=0)
+        self.assertEqual(Hit.objects.filter(header__isnull=False).count(), 0)
+        self.assertEqual(HitHeader.objects.get().header,
+                         "User-Agent: OMERO.test\nVia: 1.1 proxy's")
+        self.assertEqual(Hit.objects.filter(headers__isnull=False).count(), 3)
+
+
+class DailyDeduplicationTestCase(TestCase):
+
+    def setUp(self):
+        Version.objects.create(version="1.2.3")
+        Agent.objects.create(agent_name="OMERO.web",
+                             display_name="OMERO.web")
+        self.factory = RequestFactory()
+        ip_cache.lru.clear()
+        daily_dedup._seen = set()
+
+    def test_first_hit_of_the_day(self):
+        hit_url = reverse('registry_hit')
+        for i in range(3):
+            request = self.factory.get(hit_url, {'version': '1.2.3'},
+                                       HTTP_USER_AGENT='OMERO.web')
+            response = views_hit(request)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(Hit.objects.count(), 1)
+        self.assertEqual(DailyHit.objects.count(), 1)
+
+    def test_other_worker(self):
+        ip = IP.objects.create(ip='10.0.0.1')
+        agent = Agent.objects.get(agent_name="OMERO.web")
+        self.assertTrue(daily_dedup.first_today(ip, agent))
+        # as seen by a worker which has not served that address today
+        daily_dedup._seen = set()
+        self.assertFalse(daily_dedup.first_today(ip, agent))
+
+
+class AgentRegistryTestCase(TestCase):
+
+    def setUp(self):
+        Agent.objects.create(agent_name="OMERO.test",
+                             display_name="OMERO.test")
+
+    def test_lookup(self):
+        self.assertEqual(agent_registry.get("OMERO.test").display_name, "OMERO.test")
+        with self.assertNumQueries(0):
+            self.assertEqual(agent_registry.get("OMERO.test").agent_name, "OMERO.test")
+            self.assertEqual(agent_registry.get("OMERO.junk"), None)
+
+    def test_reload_on_save(self):
+        agent_registry.get("OMERO.test")
+        Agent.objects.create(agent_name="OMERO.new", display_name="OMERO.new")
+        self.assertEqual(agent_registry.get("OMERO.new").display_name, "OMERO.new")
+
+
+class StatisticsTestCase(TestCase):
+
+    def setUp(self):
+        self.insight = Agent.objects.create(agent_name="OMERO.insight",
+                                            display_name="OMERO.insight")
+        self.web = Agent.objects.create(agent_name="OMERO.web",
+                                        display_name="OMERO.web")
+        uk = IP.objects.create(ip='10.0.0.2', latitude=56.4, longitude=-2.9,
+                               country='United Kingdom')
+        fr = IP.objects.create(ip='10.0.0.10', latitude=48.8, longitude=2.3,
+                               country='France')
+        # not located, never counted
+        unknown = IP.objects.create(ip='10.0.0.1')
+        yesterday = datetime.now() - timedelta(days=1)
+        for ip, agent, when, os_name in ((uk, self.insight, datetime.now(), 'Linux'),
+                                         (uk, self.insight, yesterday, 'Linux'),
+                                         (uk, self.web, datetime.now(), 'Mac OS X'),
+                                         (fr, self.web, yesterday, None),
+                                         (unknown, self.web, datetime.now(), 'Linux')):
+            Hit.objects.create(ip=ip, agent=agent, creation_date=when, os_name=os_name)
+        self.agents = [self.insight, self.web]
+        self.uk = uk
+        hit_rollup.update()
+        hit_counts.clear()
+
+    def test_last_30_days(self):
+        with self.assertNumQueries(1):
+            result = dict(Statistics(self.agents).last_30_days())
+        today = dict([(r[0], r[1]) for r in result[str(datetime.now().date())]])
+        self.assertEqual(today, {'OMERO.insight': 1, 'OMERO.web': 1, 'Total': 2})
+        self.assertEqual(len(result), 31)
+
+    def test_by_country(self):
+        with self.assertNumQueries(1):
+            result = dict(Statistics(self.agents).by_country())
+        uk = dict([(r[0], r[1]) for r in result['United Kingdom']])
+        self.assertEqual(uk, {'OMERO.insight': 2, 'OMERO.web': 1, 'Total': 3})
+        self.assertEqual(result['France'][1], ('OMERO.web', 1, None))
+
+    def test_by_ip(self):
+        with self.assertNumQueries(2):
+            result = Statistics(self.agents).by_ip()
+        self.assertEqual(result[0], ('Total', [('OMERO.insight', 2), ('OMERO.web', 2)]))
+        self.assertEqual(result[1], ('Unique', [('OMERO.insight', 1), ('OMERO.web', 2)]))
+        # sorted by address
+        self.assertEqual([r[0] for r in result[2:]], ['10.0.0.2', '10.0.0.10'])
+
+    def test_by_ip_new_hits(self):
+        Statistics(self.agents).by_ip()
+        # only the new hit is counted
+        Hit.objects.create(ip=self.uk, agent=self.web)
+        with self.assertNumQueries(2):
+            result = dict(Statistics(self.agents).by_ip())
+        uk = dict([(r[0], r[1]) for r in result['10.0.0.2']])
+        self.assertEqual(uk, {'OMERO.insight': 2, 'OMERO.web': 2, 'Total': 4})
+        with self.assertNumQueries(1):
+            Statistics(self.agents).by_ip()
+
+    def test_by_ip_late_commit(self):
+        # a lower id committed after the counts, as the hit queues of two
+        # workers may do
+        late = Hit.objects.create(ip=self.uk, agent=self.web)
+        Hit.objects.create(ip=self.uk, agent=self.web)
+        late_id = late.id
+        late.delete()
+        Statistics(self.agents).by_ip()
+        late.id = late_id
+        late.save(force_insert=True)
+        result = dict(Statistics(self.agents).by_ip())
+        uk = dict([(r[0], r[1]) for r in result['10.0.0.2']])
+        self.assertEqual(uk, {'OMERO.insight': 2, 'OMERO.web': 3, 'Total': 5})
+
+    def test_by_ip_settled(self):
+        window = hit_counts.window
+        hit_counts.window = 1
+        try:
+            Statistics(self.agents).by_ip()
+            Hit.objects.create(ip=self.uk, agent=self.web)
+            result = dict(Statistics(self.agents).by_ip())
+        finally:
+            hit_counts.window = window
+        uk = dict([(r[0], r[1]) for r in result['10.0.0.2']])
+        self.assertEqual(uk, {'OMERO.insight': 2, 'OMERO.web': 2, 'Total': 4})
+
+    def test_by_ip_recount(self):
+        window, timeout = hit_counts.window, hit_counts.timeout
+        hit_counts.window = 1
+        try:
+            # committed below the settled id, only a recount finds it
+            late = Hit.objects.create(ip=self.uk, agent=self.web)
+            Hit.objects.create(ip=self.uk, agent=self.web)
+            Hit.objects.create(ip=self.uk, agent=self.web)
+            late_id = late.id
+            late.delete()
+            Statistics(self.agents).by_ip()
+            late.id = late_id
+            late.save(force_insert=True)
+            # new hits above the settled id keep the counts
+            Hit.objects.create(ip=self.uk, agent=self.web)
+            result = dict(Statistics(self.agents).by_ip())
+            uk = dict([(r[0], r[1]) for r in result['10.0.0.2']])
+            self.assertEqual(uk['OMERO.web'], 4)
+            hit_counts.timeout = -1
+            result = dict(Statistics(self.agents).by_ip())
+        finally:
+            hit_counts.window, hit_counts.timeout = window, timeout
+        uk = dict([(r[0], r[1]) for r in result['10.0.0.2']])
+        self.assertEqual(uk, {'OMERO.insight': 2, 'OMERO.web': 5, 'Total': 7})
+
+    def test_charts(self):
+        get_cache('charts').clear()
+        for stats in (1, 3, 5):
+            rsp = self.client.get(reverse('registry_local_statistic_chart'), {'stats': stats})
+            self.assertEqual(rsp['Content-Type'], 'image/png')
+
+    def test_weekly(self):
+        with self.assertNumQueries(1):
+            result = Statistics(self.agents).weekly()
+        self.assertEqual(sum([dict([(r[0], r[1]) for r in week[1]])['Total']
+                              for week in result]), 4)
+
+    def test_by_os(self):
+        result, detailed = Statistics(self.agents).by_os()
+        self.assertEqual(result[0], ('Linux', 2, 200.0/3))
+        self.assertEqual(dict([(r[0], r[1]) for r in result]),
+                         {'Linux': 2, 'Mac OS X': 1, 'Others': 1})
+
+    def test_rollup(self):
+        # two rows for today: insight and web from the UK
+        today = HitDailyRollup.objects.filter(day=datetime.now().date())
+        self.assertEqual(sorted([(r.agent_id, r.hits, r.ips) for r in today]),
+                         [(self.insight.id, 1, 1), (self.web.id, 1, 1)])
+        self.assertEqual(hit_rollup.update(), 0)
+
+    def test_incremental_rollup(self):
+        yesterday = (datetime.now() - timedelta(days=1)).date()
+        before = sorted(HitDailyRollup.objects.filter(day=yesterday).values_list('id', flat=True))
+        Hit.objects.create(ip=self.uk, agent=self.insight, os_name='Linux')
+        self.assertEqual(hit_rollup.update(), 1)
+        row = HitDailyRollup.objects.get(day=datetime.now().date(),
+                                         agent=self.insight)
+        self.assertEqual((row.hits, row.ips), (2, 1))
+        # yesterday is not recomputed
+        after = sorted(HitDailyRollup.objects.filter(day=yesterday).values_list('id', flat=True))
+        self.assertEqual(before, after)
+
+    def test_rebuild(self):
+        HitDailyRollup.objects.all().delete()
+        call_command('rollup_hits', rebuild=True, verbosity=0)
+        self.assertEqual(sum([r.hits for r in HitDailyRollup.objects.all()]), 4)
+
+
+class MarkersTestCase(TestCase):
+
+    def setUp(self):
+        get_cache('markers').clear()
+
+    def test_build_markers(self):
+        rows = [(1, '10.0.0.1', 1.0, 2.0, 'OMERO.insight'),
+                (1, '10.0.0.1', 1.0, 2.0, 'OMERO.web'),
+                (3, '10.0.0.3', 5.0, 6.0, 'OMERO.web')]
+        others = [(1, '10.0.0.1', 1.0, 2.0), (2, '10.0.0.2', 3.0, 4.0),
+                  (3, '10.0.0.3', 5.0, 6.0)]
+        markers = build_markers(rows, others)
+        self.assertEqual([(m.id, m.agent_name) for m in markers],
+                         [(1, 'OMERO.insight, OMERO.web'), (3, 'OMERO.web'),
+                          (2, 'unknown')])
+
+    def test_markers_xml(self):
+        agent = Agent.objects.create(agent_name="OMERO.web", display_name="OMERO.web")
+        ip = IP.objects.create(ip='10.0.0.2', latitude=56.4, longitude=-2.9)
+        IP.objects.create(ip='10.0.0.3', latitude=48.8, longitude=2.3)
+        Hit.objects.create(ip=ip, agent=agent)
+        Continents.objects.create(continent_name="All", n=90, s=-90, w=-180, e=180,
+                                  centerx=0, centery=0, zoom=1)
+        response = self.client.get(reverse('registry_geoxml'), {'continent': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.count('<object'), 2)
+        self.assertTrue('unknown' in response.content)
+
+        response = self.client.get(reverse('registry_geojson'), {'continent': 1})
+        self.assertEqual(response.status_code, 200)
+        features = simplejson.loads(response.content)['features']
+        self.assertEqual([(f['geometry']['coordinates'], f['properties']['agent']) for f in features],
+                         [([-2.9, 56.4], 'OMERO.web'), ([2.3, 48.8], 'unknown')])
+
+        response = self.client.get(reverse('registry_geojson'), {'agent': agent.id})
+        features = simplejson.loads(response.content)['features']
+        self.assertEqual(len(features), 1)
+
+        for params in ({'continent': 999}, {'continent': 'x'}, {'agent': 999}, {'zoom': 3, 'continent': 999}):
+            response = self.client.get(reverse('registry_geojson'), params)
+            self.assertEqual(response.status_code, 404)
+
+
+class MarkerClustersTestCase(TestCase):
+
+    def setUp(self):
+        marker_clusters.clear()
+        self.web = Agent.objects.create(agent_name="OMERO.web", display_name="OMERO.web")
+        self.insight = Agent.objects.create(agent_name="OMERO.insight", display_name="OMERO.insight")
+        dundee = IP.objects.create(ip='10.0.0.2', latitude=56.46, longitude=-2.97)
+        perth = IP.objects.create(ip='10.0.0.3', latitude=56.40, longitude=-3.43)
+        IP.objects.create(ip='10.0.0.4', latitude=53.35, longitude=-6.26)
+        Hit.objects.create(ip=dundee, agent=self.web)
+        Hit.objects.create(ip=dundee, agent=self.insight)
+        Hit.objects.create(ip=perth, agent=self.web)
+        marker_clusters.build()
+
+    def tearDown(self):
+        marker_clusters.clear()
+
+    def test_not_built(self):
+        marker_clusters.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(list(marker_clusters.clusters(5)), [])
+        call_command('warm_markers', verbosity=0)
+        self.assertEqual(len(list(marker_clusters.clusters(5))), 2)
+
+    def test_clusters_by_zoom(self):
+        # a single cluster for the world
+        clusters = list(marker_clusters.clusters(0))
+        self.assertEqual([(c[2], c[3]) for c in clusters],
+                         [(3, {'OMERO.web': 2, 'OMERO.insight': 1, 'unknown': 1})])
+        # Scotland and Dublin apart
+        clusters = sorted([(c[2], c[3]) for c in marker_clusters.clusters(5)])
+        self.assertEqual(clusters, [(1, {'unknown': 1}),
+                                    (2, {'OMERO.web': 2, 'OMERO.insight': 1})])
+
+    def test_bbox_and_agent(self):
+        clusters = list(marker_clusters.clusters(5, bbox=(-10, 50, -5, 55)))
+        self.assertEqual([c[2] for c in clusters], [1])
+        clusters = list(marker_clusters.clusters(5, agent_name='OMERO.insight'))
+        self.assertEqual([(c[2], c[3]) for c in clusters], [(1, {'OMERO.insight': 1})])
+
+    def test_geojson_clusters(self):
+        response = self.client.get(reverse('registry_geojson'),
+                                   {'zoom': 5, 'bbox': '-5,55,0,60'})
+        features = simplejson.loads(response.content)['features']
+        self.assertEqual([f['properties']['count'] for f in features], [2])
+        response = self.client.get(reverse('registry_geojson'), {'zoom': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+class GeohashTestCase(TestCase):
+
+    def test_encode(self):
+        self.assertEqual(geohash.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        ip = IP.objects.create(ip='10.0.0.2', latitude=57.64911, longitude=10.40744)
+        self.assertEqual(ip.geohash, 'u4pruydqq')
+        self.assertEqual(IP.objects.create(ip='10.0.0.3').geohash, None)
+
+    def test_bbox_ranges(self):
+        import random
+        random.seed(0)
+        for w, s, e, n in ((-10, 35, 40, 70), (170, -50, -170, -30), (-180, -90, 180, 90)):
+            ranges = geohash.bbox_ranges(w, s, e, n)
+            self.assertTrue(len(ranges) <= geohash.MAX_CELLS * 2)
+            for i in range(0, 200):
+                lat = random.uniform(s, n)
+                lon = w <= e and random.uniform(w, e) or random.uniform(w, e + 360)
+                lon = lon > 180 and lon - 360 or lon
+                h = geohash.encode(lat, lon)
+                self.assertTrue([r for r in ranges if h >= r[0] and (r[1] is None or h < r[1])])
+
+    def test_continent_markers(self):
+        agent = Agent.objects.create(agent_name="OMERO.web", display_name="OMERO.web")
+        # 1 is every continent
+        Continents.objects.create(continent_name="All", n=90, s=-90, w=-180, e=180,
+                                  centerx=0, centery=0, zoom=1)
+        europe = Continents.objects.create(continent_name="Europe", n=70, s=35, w=-10, e=40,
+                                           centerx=0, centery=0, zoom=3)
+        dundee = IP.objects.create(ip='192.168.0.2', latitude=56.46, longitude=-2.97)
+        IP.objects.create(ip='192.168.0.3', latitude=48.85, longitude=2.35)
+        IP.objects.create(ip='192.168.0.4', latitude=40.71, longitude=-74.0)
+        Hit.objects.create(ip=dundee, agent=agent)
+        response = self.client.get(reverse('registry_geojson'), {'continent': europe.id})
+        features = simplejson.loads(response.content)['features']
+        self.assertEqual([f['properties']['agent'] for f in features], ['OMERO.web', 'unknown'])
+
+
+class MarkerCacheTestCase(TestCase):
+
+    def setUp(self):
+        get_cache('markers').clear()
+        self.world = Continents.objects.create(continent_name="All", n=90, s=-90, w=-180, e=180,
+                                               centerx=0, centery=0, zoom=1)
+        self.europe = Continents.objects.create(continent_name="Europe", n=70, s=35, w=-10, e=40,
+                                                centerx=0, centery=0, zoom=3)
+        self.asia = Continents.objects.create(continent_name="Asia", n=70, s=-10, w=40, e=180,
+                                              centerx=0, centery=0, zoom=3)
+        self.agent = Agent.objects.create(agent_name="OMERO.web", display_name="OMERO.web")
+        Hit.objects.create(ip=IP.objects.create(ip='192.168.0.2', latitude=56.46, longitude=-2.97),
+                           agent=self.agent)
+
+    def test_warm(self):
+        self.assertEqual(marker_cache.warm(), 4)
+        with self.assertNumQueries(0):
+            for cont in (self.world, self.europe, self.asia):
+                marker_cache.get(continent=cont.id)
+            data = marker_cache.get(agent=self.agent.id)
+        self.assertEqual(data.count('<object'), 1)
+
+    def test_new_ip_invalidates_continent(self):
+        call_command('warm_markers', verbosity=0)
+        IP.objects.create(ip='192.168.0.3', latitude=48.85, longitude=2.35)
+        cache = get_cache('markers')
+        self.assertEqual(cache.get(marker_key(continent=self.world.id)), None)
+        self.assertEqual(cache.get(marker_key(continent=self.europe.id)), None)
+        self.assertNotEqual(cache.get(marker_key(continent=self.asia.id)), None)
+        self.assertEqual(marker_cache.get(continent=self.europe.id).count('<object'), 2)
+        with self.assertNumQueries(0):
+            marker_cache.invalidate(40.71, -74.0)
+
+    def test_rebuild(self):
+        marker_cache.warm()
+        marked = time.time()
+        cache = get_cache('markers')
+        with self.assertNumQueries(0):
+            # built after the mark
+            self.assertTrue(marker_cache.rebuild(self.europe.id, marked - 60))
+            # the world waits for world_delay
+            self.assertFalse(marker_cache.rebuild(self.world.id, marked))
+            # another worker holds the lease
+            cache.add(marker_key(continent=self.europe.id) + ':lock', 0)
+            self.assertFalse(marker_cache.rebuild(self.europe.id, marked))
+        cache.delete(marker_key(continent=self.europe.id) + ':lock')
+        self.assertTrue(marker_cache.rebuild(self.europe.id, marked))
+        self.assertTrue(cache.get(marker_key(continent=self.europe.id) + ':built') >= marked)
+
+
+class ChartCacheTestCase(TestCase):
+
+    def setUp(self):
+        get_cache('charts').clear()
+        self.factory = RequestFactory()
+        self.drawn = 0
+
+    def draw(self, fig, data):
+        self.drawn += 1
+        pie_chart(fig, data)
+
+    def test_conditional_requests(self):
+        data = ('Formats', [('tiff', 2), ('dv', 1)])
+        rsp = chart_cache.response(self.factory.get('/'), 'test', data, self.draw)
+        self.assertEqual(rsp.status_code, 200)
+        self.assertEqual(rsp['Content-Type'], 'image/png')
+        self.assertTrue(rsp.content.startswith('\x89PNG'))
+        etag = rsp['ETag']
+        modified = rsp['Last-Modified']
+
+        rsp = chart_cache.response(self.factory.get('/', HTTP_IF_NONE_MATCH=etag), 'test', data, self.draw)
+        self.assertEqual(rsp.status_code, 304)
+        rsp = chart_cache.response(self.factory.get('/', HTTP_IF_MODIFIED_SINCE=modified),
+                                   'test', data, self.draw)
+        self.assertEqual(rsp.status_code, 304)
+        # rendered once
+        self.assertEqual(self.drawn, 1)
+
+        # new data, new chart
+        rsp = chart_cache.response(self.factory.get('/', HTTP_IF_NONE_MATCH=etag), 'test',
+                                   ('Formats', [('tiff', 3), ('dv', 1)]), self.draw)
+        self.assertEqual(rsp.status_code, 200)
+        self.assertNotEqual(rsp['ETag'], etag)
+        self.assertEqual(self.drawn, 2)
+
+    def test_no_pyplot_figures(self):
+        from matplotlib._pylab_helpers import Gcf
+        chart_cache.response(self.factory.get('/'), 'test', ('Formats', [('tiff', 1)]), self.draw)
+        self.assertEqual(Gcf.get_num_fig_managers(), 0)
+
+
+class FileStatTestCase(TestCase):
+
+    def setUp(self):
+        _file_stat.clear()
+        _results.clear()
+        tiff = FileFormat.objects.create(format_name="TIFF", selected="tiff")
+        dv = FileFormat.objects.create(format_name="DeltaVision", selected="dv")
+        FileFormat.objects.create(format_name="Zeiss", selected="zvi")
+        last_year = datetime.now() - timedelta(days=400)
+        for f in (tiff, tiff, tiff, dv, None):
+            TestFile.objects.create(file_name="test", file_format=f)
+        old = TestFile.objects.create(file_name="old", upload_date=last_year)
+        TestEngineResult.objects.create(test_file=old, started=last_year, error="failed")
+        TestEngineResult.objects.create(test_file=old, started=datetime.now())
+        TestEngineResult.objects.create(test_file=old, started=datetime.now(), error="failed")
+
+    def tearDown(self):
+        _file_stat.clear()
+        _results.clear()
+
+    def test_results_summary(self):
+        beginning = "%s-%s-01" % (datetime.now().year, datetime.now().month)
+        with self.assertNumQueries(2):
+            summary = results_summary()
+        self.assertEqual(summary['total'], total_results())
+        self.assertEqual(summary['month'], custom_date_results(beginning))
+        self.assertEqual(summary['today'], custom_date_results())
+        self.assertEqual(summary['today'], {'files': 5, 'results': 2, 'failure': 2})
+        with self.assertNumQueries(0):
+            results_summary()
+
+    def test_file_stat(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(file_stat(), {'TIFF': 3, 'DeltaVision': 1})
+            self.assertEqual(file_stat_percent(), {'TIFF': 75.0, 'DeltaVision': 25.0})
+
+
+class SessionPoolTestCase(TestCase):
+
+    def setUp(self):
+        self.connector = StubConnector()
+        # no keep-alive thread, ping is called by the tests
+        self.pool = SessionPool(self.connector, 2, 0, 0.1)
+
+    def test_reuse(self):
+        with self.pool.session() as conn:
+            pass
+        with self.pool.session() as again:
+            self.assertTrue(again is conn)
+        self.assertEqual(len(self.connector.connections), 1)
+
+    def test_bounded(self):
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        self.assertRaises(SessionPoolError, self.pool.acquire)
+        self.pool.release(first)
+        self.assertTrue(self.pool.acquire() is first)
+        self.pool.release(second)
+
+    def test_reconnect(self):
+        with self.pool.session() as conn:
+            pass
+        conn.kill()
+        with self.pool.session() as again:
+            self.assertTrue(again is not conn)
+            self.assertTrue(again.alive)
+        self.assertTrue(conn.closed)
+
+    def test_failed_request(self):
+        def fail():
+            with self.pool.session() as conn:
+                conn.kill()
+                raise ValueError()
+        self.assertRaises(ValueError, fail)
+        self.assertTrue(self.connector.connections[0].closed)
+        # the dead session no longer counts against the size
+        self.pool.acquire()
+        self.pool.acquire()
+
+    def test_server_down(self):
+        self.connector.down = True
+        self.assertRaises(SessionPoolError, self.pool.acquire)
+        self.connector.down = False
+        self.pool.acquire()
+        self.pool.acquire()
+
+    def test_ping(self):
+        with self.pool.session() as conn:
+            pass
+        self.assertEqual(self.pool.ping(), 1)
+        self.assertEqual(self.connector.pings, 1)
+        conn.kill()
+        self.pool.ping()
+        self.assertTrue(conn.closed)
+        self.pool.close()
@@ -34,6 +34,7 @@ urlpatterns = patterns('',
 
     url( r'^geomap/$', views.geomap, name='registry_geomap'),
     url( r'^geoxml/$', views.get_markers_as_xml, name='registry_geoxml'),
+    url( r'^geojson/$', views.get_markers_as_geojson, name='registry_geojson'),
     
     url( r'^hit/$', views.hit, name='registry_hit'),
     
@@ -43,6 +44,7 @@ urlpatterns = patterns('',
     url( r'^local_statistic/$', views.local_statistic, name='registry_local_statistic'),
     url( r'^local_stat_chart/$', views.local_statistic_chart, name='registry_local_statistic_chart'),
     url( r'^check_country/$', views.ip2country, name='ip2country'),
+    url( r'^cache_stats/$', views.cache_stats, name='registry_cache_stats'),
     url( r'^stat_chart/$', views.statistic_chart, name='registry_statistic_chart'),
     url( r'^file_stat_chart/$', views.file_statistic_chart, name='registry_file_statistic_chart'),
     
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+#
+#
+#
+# Copyright (c) 2015 University of Dundee.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Version: 1.0
+#
+
+import re
+import time
+import logging
+import threading
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+
+from omero_qa.registry.lru import LRUCache
+from omero_qa.registry.models import Version
+
+logger = logging.getLogger('versions-registry')
+
+VERSION_REGEX = re.compile("^.*?[-]?(\\d+[.]\\d+([.]\\d+)?)[-]?.*?$")
+
+# "5.1" is the same release as "5.1.0"
+VERSION_LENGTH = 3
+
+_parsed = LRUCache('agent_version', settings.REGISTRY_VERSION_CACHE_SIZE)
+_unparsable = object()
+
+
+def parse_version(version):
+    """
+    Returns the release of a version string as a tuple of integers,
+    e.g. (5, 1, 0) for "OMERO-5.1.0-ice35-b40", or None.
+    """
+    if version is None:
+        return None
+    rv = _parsed.get(version)
+    if rv is None:
+        m = VERSION_REGEX.match(version)
+        if m is None:
+            rv = _unparsable
+        else:
+            rv = tuple([int(v) for v in m.group(1).split(".")])
+            rv = rv + (0,) * (VERSION_LENGTH - len(rv))
+        _parsed.set(version, rv)
+    if rv is _unparsable:
+        return None
+    return rv
+
+
+class VersionPolicy(object):
+    """
+    Answers whether an agent has to be upgraded to the current release.
+    The release is loaded once and kept for timeout seconds. Saving the
+    Version from the admin reloads it in this process straight away, the
+    other workers see it within timeout seconds.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._current = None
+        self._loaded = 0
+        self._lock = threading.Lock()
+
+    def current(self):
+        """ Returns (version string, parsed version) of the current release. """
+        current = self._current
+        if current is None or time.time() - self._loaded > self.timeout:
+            with self._lock:
+                ver = Version.objects.get(pk=1)
+                current = (ver.version, parse_version(ver.version))
+                self._current = current
+                self._loaded = time.time()
+                logger.debug("Current version %s" % ver.version)
+        return current
+
+    def invalidate(self):
+        self._current = None
+
+    def needs_upgrade(self, agent_version):
+        """
+        Agents which do not send a parsable version are always
+        told to upgrade.
+        """
+        agent = parse_version(agent_version)
+        if agent is None:
+            return True
+        local = self.current()[1]
+        if local is None:
+            return True
+        return agent < local
+
+
+version_policy = VersionPolicy(settings.REGISTRY_VERSION_TIMEOUT)
+
+
+def _invalidate_version(sender, **kwargs):
+    version_policy.invalidate()
+
+post_save.connect(_invalidate_version, sender=Version, dispatch_uid='registry_version_save')
+post_delete.connect(_invalidate_version, sender=Version, dispatch_uid='registry_version_delete')
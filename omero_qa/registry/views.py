@@ -37,12 +37,9 @@ import random
 import re 
 from random import choice
 import urlparse
-from cStringIO import StringIO
 from itertools import *
 from datetime import datetime, date, timedelta
 
-from pygeoip import GeoIP, STANDARD, MEMORY_CACHE
-
 UPGRADE_CHECK_URL = "http://www.openmicroscopy.org/site/support/omero4/sysadmins/UpgradeCheck.html"
 
 # Use the system (hardware-based) random number generator if it exists.
@@ -52,7 +49,7 @@ else:
     randrange = random.randrange
 
 from django.core.urlresolvers import resolve, reverse
-from django.http import HttpResponse, HttpResponseRedirect, Http404
+from django.http import HttpResponse, HttpResponseRedirect, HttpResponseBadRequest, Http404
 from django.conf import settings
 from django.template import RequestContext as Context
 from django.template.loader import get_template
@@ -65,28 +62,34 @@ from django.core import serializers
 from django.core.mail import send_mail
 from django.core.mail import EmailMultiAlternatives
 from django.core.cache import cache
+from django.utils import simplejson
 
 from omero_qa.feedback.views import handlerInternalError
+from omero_qa.geolocation import get_resolver
 from omero_qa.registry.models import Agent, IP, Hit, Version, Continents, ContinentsForm, AgentForm, DemoAccountForm
 from omero_qa.qa.models import TestFile
 from omero_qa.qa.forms import LoginForm
 from omero_qa.qa.views import check_if_error
 from omero_qa.registry.delegator import *
+from omero_qa.registry.agents import agent_registry
+from omero_qa.registry.charts import chart_cache, pie_chart, hits_chart, results_chart
+from omero_qa.registry.clusters import marker_clusters
+from omero_qa.registry.dedup import daily_dedup
+from omero_qa.registry.headers import encode_headers, get_header_id
+from omero_qa.registry.ipcache import ip_cache
+from omero_qa.registry.markers import marker_cache
+from omero_qa.registry.rollup import hit_rollup
+from omero_qa.registry.versions import version_policy
+from omero_qa.registry import lru
     
 logger = logging.getLogger('views-registry')
 
 logger.info("INIT '%s'" % os.getpid())
 
-try:
-    from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-    import numpy as np
-    import matplotlib.pyplot as plt
-    from pylab import *    
-except:
-    logger.error(traceback.format_exc())
-
-
-connectors = {}
+def _statistics(agents):
+    # the reports read the daily rollups, fold in the new hits first
+    hit_rollup.refresh()
+    return Statistics(agents)
 
 ### VIEWS ###
 
@@ -219,130 +222,84 @@ def geomap(request, **kwargs):
 
 
 def get_markers_as_xml(request):
-    """Run a simple query and produce a generator
-    that returns the results as a bunch of dictionaries
-    with keys for the column values selected.
     """
-    cache_continent = request.REQUEST.get('continent') is not None and ("continent%s" % request.REQUEST.get('continent')) or None
-    cache_agent = request.REQUEST.get('agent') is not None and ("agent%s" % request.REQUEST.get('agent')) or None
-    ips = list()
-    data = None
-    
-    if cache_continent is not None:
-        data = cache.get(cache_continent)
-        logger.info("XML data for '%s' loaded from chache" % cache_continent)
-    elif cache_agent is not None:
-        data = cache.get(cache_agent)
-        logger.info("XML data for '%s' loaded from chache" % cache_agent)
-        
-    if data is None:
-        if request.REQUEST.get('continent') is not None:
-            cont = Continents.objects.get(pk=request.REQUEST.get('continent'))
-            logger.debug("N: '%s', S: '%s', W: '%s', E: '%s'" % (cont.n, cont.s, cont.w, cont.e))
-            cursor = connection.cursor()
+    The markers of a continent or of an agent from the marker cache,
+    see registry.markers.
+    """
+    continent = request.REQUEST.get('continent')
+    agent = request.REQUEST.get('agent')
+    data = serializers.serialize('xml', [])
+    if continent is not None or agent is not None:
+        try:
+            data = marker_cache.get(continent=continent, agent=agent)
+        except:
+            logger.debug(traceback.format_exc())
+    return HttpResponse(data, mimetype='application/xml')
 
-            if request.REQUEST.get('continent') == "1":
-                logger.debug("Every continents...")
-                allips = list(IP.objects.exclude(latitude=None).exclude(longitude=None))      
-                logger.debug("Total number of IPs is: %i" % len(allips))
-
-                query = 'SELECT DISTINCT registry_hit.ip_id, registry_ip.ip, registry_ip.latitude, registry_ip.longitude, registry_agent.display_name \
-                FROM registry_ip, registry_agent, registry_hit \
-                WHERE registry_hit.ip_id = registry_ip.id \
-                AND registry_hit.agent_id = registry_agent.id \
-                AND (registry_ip.longitude is not null AND registry_ip.latitude is not null ) \
-                ORDER BY registry_hit.ip_id ASC'
-                try:
-                    cursor.execute(query)
-                except:
-                    logger.debug(traceback.format_exc())
-                logger.debug("query executed")
-            else:
-                allips = list(IP.objects.filter(latitude__gte=cont.s, latitude__lte=cont.n,\
-                                            longitude__gte=cont.w, longitude__lte=cont.e).exclude(ip__startswith="10."))
-                logger.debug("Total number of IPs is: %i" % len(allips))
-
-                query = 'SELECT DISTINCT registry_hit.ip_id, registry_ip.ip, registry_ip.latitude, registry_ip.longitude, registry_agent.display_name \
-                FROM registry_ip, registry_agent, registry_hit \
-                WHERE registry_hit.ip_id = registry_ip.id \
-                AND registry_hit.agent_id = registry_agent.id \
-                AND (registry_ip.longitude <= %s AND registry_ip.longitude >= %s \
-                AND registry_ip.latitude >= %s AND registry_ip.latitude <= %s ) \
-                ORDER BY registry_hit.ip_id ASC'
-                try:
-                    cursor.execute(query, [cont.e, cont.w, cont.s, cont.n])
-                except:
-                    logger.debug(traceback.format_exc())
-                logger.debug("query executed")
-            temp = None
-            try:
-                logger.debug("building objects IPforXML")
-                result = cursor.fetchall()
-                for row in result:
-                    if temp is not None and temp.id == row[0]:
-                        p = ips[len(ips)-1]
-                        ips.remove(p)
-                        p.agent_name = "%s, %s" %  (p.agent_name, row[4])
-                    else:
-                        p = IPforXML(id=row[0], ip=row[1], latitude=row[2], longitude=row[3], agent_name=row[4])
-                        temp = p
-
-                    flag = False
-                    for ip in allips:
-                        if ip.id == row[0]:
-                            allips.remove(ip)
-                            flag = True
-                        if flag:
-                            break
-                    ips.append(p)
-            except:
-                logger.debug(traceback.format_exc())
-
-            # add rest of ips
-            for ip in allips:
-                p = IPforXML(id=ip.id, ip=ip.ip, latitude=ip.latitude, longitude=ip.longitude, agent_name="unknown")
-                ips.append(p)
-            logger.debug("IPS: %s" % len(ips))
-        elif request.REQUEST.get('agent') is not None:
-            agent = Agent.objects.get(pk=request.REQUEST.get('agent'))
-            logger.debug("Agent '%s' on every continents..." % agent.agent_name)
-            cursor = connection.cursor()
-
-            query = """SELECT DISTINCT registry_hit.ip_id, registry_ip.ip, registry_ip.latitude, registry_ip.longitude, registry_agent.display_name \
-            FROM registry_ip, registry_agent, registry_hit \
-            WHERE registry_hit.ip_id = registry_ip.id \
-            AND registry_hit.agent_id = registry_agent.id \
-            AND (registry_ip.longitude is not null AND registry_ip.latitude is not null ) \
-            AND registry_hit.agent_id = %s \
-            ORDER BY registry_hit.ip_id ASC"""
-            try:
-                cursor.execute(query, [agent.id])
-            except:
-                logger.debug(traceback.format_exc())
 
-            temp = None
-            try:
-                result = cursor.fetchall()
-                for row in result:
-                    if temp is not None and temp.id == row[0]:
-                        p = ips[len(ips)-1]
-                        ips.remove(p)
-                        p.agent_name = "%s, %s" %  (p.agent_name, row[4])
-                    else:
-                        p = IPforXML(id=row[0], ip=row[1], latitude=row[2], longitude=row[3], agent_name=row[4])
-                        temp = p
-                    ips.append(p)
-            except:
-                logger.debug(traceback.format_exc())
-            logger.debug("IPS: %s" % len(ips))
-
-        data = serializers.serialize('xml', ips, fields=('latitude', 'longitude', 'agent_name'))
-        if cache_continent is not None:
-            cache.set(cache_continent, data, settings.CACHE_TIMEOUT)
-        elif cache_agent is not None:
-            cache.set(cache_agent, data, settings.CACHE_TIMEOUT)
-            
-    return HttpResponse(data, mimetype='application/xml')
+def get_markers_as_geojson(request):
+    """
+    The markers of get_markers_as_xml as a GeoJSON FeatureCollection of
+    points with the agent names, streamed from the cursor.
+    
+    Given a zoom level, the markers are clustered by registry.clusters
+    within the bbox (west,south,east,north, by default the bounds of the
+    continent) and each point has the number of addresses per agent.
+    """
+    continent = request.REQUEST.get('continent')
+    agent = request.REQUEST.get('agent')
+    zoom = request.REQUEST.get('zoom')
+    cont = None
+    agt = None
+    try:
+        if continent is not None:
+            cont = Continents.objects.get(pk=int(continent))
+            continent = cont.id
+        if agent is not None:
+            agt = Agent.objects.get(pk=int(agent))
+            agent = agt.id
+    except (ValueError, Continents.DoesNotExist, Agent.DoesNotExist):
+        raise Http404()
+    if zoom is not None:
+        try:
+            zoom = int(zoom)
+            bbox = request.REQUEST.get('bbox')
+            if bbox is not None:
+                bbox = tuple([float(b) for b in bbox.split(",")])
+                if len(bbox) != 4:
+                    raise ValueError("bbox is west,south,east,north")
+            elif cont is not None:
+                bbox = (cont.w, cont.s, cont.e, cont.n)
+        except ValueError, x:
+            return HttpResponseBadRequest(str(x))
+        agent_name = agt is not None and agt.display_name or None
+        clusters = list(marker_clusters.clusters(zoom, bbox, agent_name))
+
+        def features():
+            yield '{"type":"FeatureCollection","features":['
+            sep = ''
+            for latitude, longitude, count, agents in clusters:
+                yield '%s{"type":"Feature","geometry":{"type":"Point","coordinates":[%r,%r]},"properties":{"count":%i,"agents":%s}}' \
+                    % (sep, longitude, latitude, count, simplejson.dumps(agents, separators=(',',':')))
+                sep = ','
+            yield ']}'
+    
+    else:
+        if continent is None and agent is None:
+            return HttpResponseBadRequest("continent, agent or zoom is required")
+        cursor, others = marker_rows(continent=continent, agent=agent)
+        others = others is not None and others.iterator() or ()
+
+        def features():
+            yield '{"type":"FeatureCollection","features":['
+            sep = ''
+            for ip_id, ip, latitude, longitude, agent_name in iter_markers(fetch_rows(cursor), others):
+                yield '%s{"type":"Feature","geometry":{"type":"Point","coordinates":[%r,%r]},"properties":{"agent":%s}}' \
+                    % (sep, longitude, latitude, simplejson.dumps(agent_name))
+                sep = ','
+            yield ']}'
+
+    return HttpResponse(features(), mimetype='application/json')
 
 
 def hit(request):
@@ -352,12 +309,12 @@ def hit(request):
         agt = request.META.get('HTTP_USER_AGENT', '')
         if agt is not None and agt.startswith("OMERO."):
             try:
-                agent = Agent.objects.get(agent_name=agt)
-            except Agent.DoesNotExist:
-                return HttpResponseRedirect(UPGRADE_CHECK_URL)
+                agent = agent_registry.get(agt)
             except:
                 logger.error(traceback.format_exc())
                 return HttpResponseRedirect(UPGRADE_CHECK_URL)
+            if agent is None:
+                return HttpResponseRedirect(UPGRADE_CHECK_URL)
         else:
                 return HttpResponseRedirect(UPGRADE_CHECK_URL)
     except:
@@ -369,23 +326,8 @@ def hit(request):
     update = None
     try:
         agent_version = request.REQUEST.get('version')
-        ver = Version.objects.get(pk=1)
-        if agent_version is not None:
-            try:
-                regex = re.compile("^.*?[-]?(\\d+[.]\\d+([.]\\d+)?)[-]?.*?$")
-
-                agent_cleaned = regex.match(agent_version).group(1)
-                agent_split = agent_cleaned.split(".")
-
-                local_cleaned = regex.match(ver.version).group(1)
-                local_split = local_cleaned.split(".")
-
-                rv = (agent_split < local_split)
-            except:
-                rv = True
-            if rv:
-                update = 'Please upgrade to %s. See %s for the latest version.' % (ver, stable_omero_downloads)
-        else:
+        if version_policy.needs_upgrade(agent_version):
+            ver = version_policy.current()[0]
             update = 'Please upgrade to %s. See %s for the latest version.' % (ver, stable_omero_downloads)
     except:
         logger.debug(traceback.format_exc())
@@ -405,34 +347,15 @@ def hit(request):
             real_ip = request.META.get('REMOTE_ADDR')
             
         if real_ip is not None:
-            try:
-                ip = IP.objects.get(ip=real_ip)
-            except IP.DoesNotExist:
-                latitude = None
-                longitude = None
-                country = None
-                geoip = GeoIP(settings.GEODAT, STANDARD)
-                gir = geoip.record_by_addr(real_ip)
-                if gir is not None:
-                    latitude = gir["latitude"]
-                    longitude = gir["longitude"]
-                geoip = GeoIP(settings.GEOIP, MEMORY_CACHE)
-                country = geoip.country_name_by_addr(real_ip)
-                    
-                logger.debug("IP: %s, latitude: '%s', longitude: '%s'" % (real_ip, latitude, longitude))
-                ip = IP(ip=real_ip, latitude=latitude, longitude=longitude, country=country)
-                ip.save()
+            ip = ip_cache.get_or_create(real_ip)
     except Exception, x:
         logger.debug(traceback.format_exc())
         raise x
     logger.debug("IP %s" % ip)
     
-    if agent.id == 5:
+    if daily_dedup.applies_to(agent):
         try:
-            from datetime import datetime
-            now = datetime.now()
-            h = Hit.objects.filter(ip=ip, creation_date__gte=now.strftime("%Y-%m-%d 00:00:00.000000")).count()
-            if h > 0:
+            if not daily_dedup.first_today(ip, agent):
                 logger.debug("To many hits from the ip %s by the agent %s" % (ip,agent.agent_name))
                 return HttpResponse()
             else:
@@ -473,11 +396,18 @@ def hit(request):
     os_version = request.REQUEST.get('os.version')
     logger.debug("OS version %s" % os_version)
     
-    header = str(request.META)
-    logger.debug("HttpRequest.META %s" % header)
+    header = None
+    headers_id = None
+    if settings.REGISTRY_HIT_HEADERS == 'full':
+        header = str(request.META)
+        logger.debug("HttpRequest.META %s" % header)
+    elif settings.REGISTRY_HIT_HEADERS == 'compact':
+        encoded = encode_headers(request.META)
+        logger.debug("Headers %s" % encoded)
+        headers_id = get_header_id(encoded)
     
     try:
-        save_hit(ip=ip, agent=agent, agent_version=agent_version, poll=poll, os_name=os_name, os_arch=os_arch, os_version=os_version, java_vendor=java_vendor, java_version=java_version, python_version=python_version, python_compiler=python_compiler, python_build=python_build, header=header)
+        save_hit(ip=ip, agent=agent, agent_version=agent_version, poll=poll, os_name=os_name, os_arch=os_arch, os_version=os_version, java_vendor=java_vendor, java_version=java_version, python_version=python_version, python_compiler=python_compiler, python_build=python_build, header=header, headers_id=headers_id)
     except Exception, x:
         logger.debug(traceback.format_exc())
         HttpResponse(x)
@@ -503,56 +433,46 @@ def local_statistic(request):
         if stats == 1:
             result = cache.get('last_30_days')
             if result is None:
-                s = Statistics(agents)
+                s = _statistics(agents)
                 result = s.last_30_days()
-                cache.set('last_30_days', result, settings.CACHE_TIMEOUT)
+                cache.set('last_30_days', result, settings.REGISTRY_STATISTICS_TIMEOUT)
         elif stats == 2:
             result = cache.get('weekly')
             if result is None:
-                s = Statistics(agents)
+                s = _statistics(agents)
                 result = s.weekly()
-                cache.set('weekly', result, settings.CACHE_TIMEOUT)
+                cache.set('weekly', result, settings.REGISTRY_STATISTICS_TIMEOUT)
         elif stats == 3:
             result = cache.get('by_country')
             if result is None:
-                s = Statistics(agents)
+                s = _statistics(agents)
                 result = s.by_country()
-                cache.set('by_country', result, settings.CACHE_TIMEOUT)
+                cache.set('by_country', result, settings.REGISTRY_STATISTICS_TIMEOUT)
         elif stats == 4:
             result = cache.get('by_ip')
             if result is None:
-                s = Statistics(agents)
+                s = _statistics(agents)
                 result = s.by_ip()
-                cache.set('by_ip', result, settings.CACHE_TIMEOUT)
+                cache.set('by_ip', result, settings.REGISTRY_STATISTICS_TIMEOUT)
         elif stats == 5:
             full_res = cache.get('by_os')
             if full_res is None:
-                s = Statistics(agents)
+                s = _statistics(agents)
                 full_res = s.by_os()
-                cache.set('by_os', full_res, settings.CACHE_TIMEOUT)
+                cache.set('by_os', full_res, settings.REGISTRY_STATISTICS_TIMEOUT)
             result = full_res[0]
             details['Operating System (Detailed)'] = full_res[1]
         elif stats == 6:
             full_res = cache.get('by_env')
             if full_res is None:
-                s = Statistics(agents)
+                s = _statistics(agents)
                 full_res = s.by_env()
-                cache.set('by_env', full_res, settings.CACHE_TIMEOUT)
+                cache.set('by_env', full_res, settings.REGISTRY_STATISTICS_TIMEOUT)
             details['Java version'] = full_res[0]
             details['Python version'] = full_res[1]
         elif stats == 7:
             template = "registry/demo_statistic.html"
-            #result = cache.get('demo_serv')
-            #if result is None:
-            s = None
-            if connectors.has_key('demo'):
-                s = connectors['demo']
-            else:
-                s = DemoStatistics()
-                connectors['demo'] = s
-            s.ping()            
-            result = s.demostats()
-            #cache.set('demo_serv', result, settings.CACHE_TIMEOUT)
+            result = demo_statistics()
                       
         if stats != 5 and stats != 6 and stats != 7:
             for row in result[0][1]:
@@ -582,26 +502,26 @@ def local_statistic_chart(request):
             title = 'Last 30 days.'
             full_res = cache.get('last_30_days')
             if full_res is None:
-                s = Statistics(agents)
+                s = _statistics(agents)
                 full_res = s.last_30_days()
-                cache.set('last_30_days', full_res, settings.CACHE_TIMEOUT)
+                cache.set('last_30_days', full_res, settings.REGISTRY_STATISTICS_TIMEOUT)
             result = full_res
         elif stats == 2:
             title = 'Weekly'
             full_res = cache.get('weekly')
             if full_res is None:
-                s = Statistics(agents)
+                s = _statistics(agents)
                 full_res = s.weekly()
-                cache.set('weekly', full_res, settings.CACHE_TIMEOUT)
+                cache.set('weekly', full_res, settings.REGISTRY_STATISTICS_TIMEOUT)
             
             result = full_res
         elif stats == 3:
             title = 'The most popular Countries.'
             full_res = cache.get('by_country')
             if full_res is None:
-                s = Statistics(agents)
+                s = _statistics(agents)
                 full_res = s.by_country()
-                cache.set('by_country', full_res, settings.CACHE_TIMEOUT)
+                cache.set('by_country', full_res, settings.REGISTRY_STATISTICS_TIMEOUT)
             
             result = {'Others': 0 }
             for res in full_res:
@@ -616,9 +536,9 @@ def local_statistic_chart(request):
             title = 'The most popular Operating Systems.'
             full_res = cache.get('by_os')
             if full_res is None:
-                s = Statistics(agents)
+                s = _statistics(agents)
                 full_res = s.by_os()
-                cache.set('by_os', full_res, settings.CACHE_TIMEOUT)
+                cache.set('by_os', full_res, settings.REGISTRY_STATISTICS_TIMEOUT)
             
             result = {'Others': 0 }
             for res in full_res[0]:
@@ -636,20 +556,12 @@ def local_statistic_chart(request):
         return HttpResponse("No results.")
     try:
         if stats == 3 or stats == 5:
-            # make a square figure and axes
-            fig = plt.figure()
-            ax = axes([0.1, 0.1, 0.8, 0.8])
-
-            labels = result.keys()
-            fracs = result.values()
-
-            plt.pie(fracs, labels=labels, autopct='%1.1f%%', shadow=True)
-            plt.title(title)
+            return chart_cache.response(request, 'local_statistic_%i' % stats,
+                                        (title, sorted(result.items())), pie_chart)
         elif stats == 1 or stats == 2:
             
             bars = dict()
             labels = list()
-            maximum = 0
             for res in result:
                 labels.insert(0, res[0])
                 for a in agents:
@@ -659,37 +571,26 @@ def local_statistic_chart(request):
                                 bars[a.display_name].insert(0,int(r[1]))
                             else:
                                 bars[a.display_name] = [int(r[1])]
-            
-            fig = plt.figure()
-            N = len(result)
-            ind = np.arange(N)    # the x locations for the groups
-            width = 0.35       # the width of the bars: can also be len(x) sequence
-            for a in agents:
-                plt.bar(ind, tuple(bars[a.display_name]),  width)
-  
-            plt.ylabel('Hits')
-            plt.xlabel('Days')
-            plt.title(title)
-            plt.xticks(ind+width, tuple(labels), rotation=90)
-            #plt.legend( (p1[0], p2[0]), ('Men', 'Women') )
-
-            
-            
-            
-        canvas = FigureCanvas(fig)
-        imdata = StringIO()
-        canvas.print_figure(imdata)
-        return HttpResponse(imdata.getvalue(), mimetype='image/png')
+            bars = [(a.display_name, bars[a.display_name]) for a in agents if bars.has_key(a.display_name)]
+            return chart_cache.response(request, 'local_statistic_%i' % stats,
+                                        (title, labels, bars), hits_chart)
     except:
         logger.debug(traceback.format_exc())
-        return HttpResponse("Drawing chart error.")
+    return HttpResponse("Drawing chart error.")
+
+
+@login_required
+def cache_stats(request):
+    if not request.user.is_staff:
+        raise Http404()
+    stats = dict([(name, c.stats()) for name, c in lru.caches.items()])
+    return HttpResponse(simplejson.dumps(stats), mimetype='application/json')
 
 
 def ip2country(request):
     ip = str(request.REQUEST.get('ip'))
     
-    geoip = GeoIP(settings.GEOIP, MEMORY_CACHE)
-    c = geoip.country_name_by_addr(ip)
+    c = get_resolver().country_name_by_addr(ip)
     c+="; "
     whois = os.popen("whois %s 2>&1" % ip)
     file.close
@@ -720,11 +621,10 @@ def statistic(request):
     stats = request.REQUEST.get('stats')
     files, total, today, month = None, None, None, None
     if stats is None:
-        today = date.today()
-        beginning = "%s-%s-01" % (today.year, today.month) 
-        total = total_results()
-        today = custom_date_results()
-        month = custom_date_results(beginning)
+        summary = results_summary()
+        total = summary['total']
+        today = summary['today']
+        month = summary['month']
 
         from operator import itemgetter
         files = sorted(file_stat_percent().items())
@@ -739,52 +639,17 @@ def statistic(request):
 
 
 def statistic_chart(request):
-    today = date.today()
-    beginning = "%s-%s-01" % (today.year, today.month)
-    total = total_results()
+    summary = results_summary()
+    total = summary['total']
     if total.get('files') == 0:
         return HttpResponse("No images.")
-    today = custom_date_results()
-    month = custom_date_results(beginning)
-
-    N = 3
-    totalMeans = (total['files'], total['results'], total['failure'])
-    todayMeans = (today['files'], today['results'], today['failure'])
-    monthMeans = (month['files'], month['results'], month['failure'])
-    
-    ind = np.arange(N)  # the x locations for the groups
-    width = 0.15       # the width of the bars
-
-    fig = plt.figure()
-    plt.subplot(111)
-    rects1 = plt.bar(ind, totalMeans, width, color='g')
-    rects2 = plt.bar(ind+width, monthMeans, width, color='b')
-    rects3 = plt.bar(ind+2*width, todayMeans, width, color='r')
+    today = summary['today']
+    month = summary['month']
 
-    # add some
-    plt.ylabel('Files')
-    plt.title('')
-    plt.xticks(ind+1.5*width, ('Uploaded', 'Tested', 'Failure') )
-
-    plt.legend( (rects1[0], rects2[0], rects3[0]), ('Total', 'Month', 'Today') )
-
-    def autolabel(rects):
-        # attach some text labels
-        for rect in rects:
-            height = rect.get_height()
-            if height > 0:
-                plt.text(rect.get_x()+rect.get_width()/2., height-3, '%d'%int(height),
-                    ha='center', va='bottom')
-
-    autolabel(rects1)
-    autolabel(rects2)
-    autolabel(rects3)
-    
-    canvas = FigureCanvas(fig)
-    
-    imdata = StringIO()
-    canvas.print_figure(imdata)
-    return HttpResponse(imdata.getvalue(), mimetype='image/png')
+    data = ((total['files'], total['results'], total['failure']),
+            (month['files'], month['results'], month['failure']),
+            (today['files'], today['results'], today['failure']))
+    return chart_cache.response(request, 'statistic', data, results_chart)
 
 
 def file_statistic_chart(request):
@@ -792,19 +657,8 @@ def file_statistic_chart(request):
     if len(total) == 0:
         return HttpResponse("No images.")
     try:
-        # make a square figure and axes
-        fig = plt.figure()
-        ax = axes([0.1, 0.1, 0.8, 0.8])
-
-        labels = total.keys()
-        fracs = total.values()
-
-        plt.pie(fracs, labels=labels, autopct='%1.1f%%', shadow=True)
-        plt.title('File formats in testing')
-        canvas = FigureCanvas(fig)
-        imdata = StringIO()
-        canvas.print_figure(imdata)
-        return HttpResponse(imdata.getvalue(), mimetype='image/png')
+        return chart_cache.response(request, 'file_statistic',
+                                    ('File formats in testing', sorted(total.items())), pie_chart)
     except:
+        logger.debug(traceback.format_exc())
         return HttpResponse("Drawing chart error.")
-
@@ -12,3 +12,10 @@ SECRET_KEY = 'test_key'
 DEBUG = False
 TEMPLATE_DEBUG = DEBUG
 
+# store hits within the request, see registry.tests.HitQueueTestCase
+REGISTRY_HIT_WRITE_BEHIND = False
+
+# build the map markers within the request, keep the caches in memory
+CACHES['markers'] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+CACHES['charts'] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+REGISTRY_MARKER_WARMER = False
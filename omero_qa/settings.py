@@ -188,9 +188,22 @@ MIDDLEWARE_CLASSES = (
 CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.dummy.DummyCache"
-    }
+    },
+    # registry map markers, shared by the workers and warm_markers
+    "markers": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(os.path.dirname(__file__), '..', 'cache', 'markers').replace('\\', '/'),
+    },
+    # rendered statistics charts, see registry.charts
+    "charts": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(os.path.dirname(__file__), '..', 'cache', 'charts').replace('\\', '/'),
+    },
 }
 
+# Seconds the registry map markers are kept in CACHES
+CACHE_TIMEOUT = 3600
+
 # STATIC_ROOT.
 # Example: "/site_media/static/" or "http://static.example.com/".
 # If not None, this will be used as the base path for media definitions and
@@ -276,8 +289,122 @@ UPLOAD_ROOT = '/FileStore'
 
 PERPAGE = 50
 
+# The feedback list counts are cached for QA_FEEDBACK_COUNT_TIMEOUT seconds
+# per filter. The unfiltered count is estimated on PostgreSQL over
+# QA_FEEDBACK_EXACT_COUNT feedbacks.
+QA_FEEDBACK_COUNT_TIMEOUT = 300
+QA_FEEDBACK_EXACT_COUNT = 100000
+
+# The feedback text filters match through the full-text index, filled by
+# "python manage.py rebuild_search"; a search lists at most the
+# QA_SEARCH_LIMIT best matches.
+QA_SEARCH_LIMIT = 500
+
 GEOIP = os.path.join(
     os.path.dirname(__file__), '..', 'GeoIP.dat').replace('\\', '/')
 GEODAT = os.path.join(
     os.path.dirname(__file__), '..', 'GeoLiteCity.dat').replace('\\', '/')
 
+
+# How often (in seconds) the GeoIP databases are checked for changes on disk
+GEOIP_CHECK_INTERVAL = 60
+
+# In-process cache of client address -> registry_ip row used by registry hit.
+# Set REGISTRY_IP_CACHE_SHARED to also keep the resolutions in CACHES.
+REGISTRY_IP_CACHE_SIZE = 10000
+REGISTRY_IP_CACHE_TIMEOUT = 86400
+REGISTRY_IP_CACHE_SHARED = False
+
+# Registry hits are queued and stored in batches by a background thread,
+# either every REGISTRY_HIT_FLUSH_INTERVAL seconds or when
+# REGISTRY_HIT_BATCH_SIZE hits are waiting. Queued hits are spooled to
+# REGISTRY_HIT_SPOOL_DIR and stored by the next worker after a crash of a
+# worker; the spool is not fsynced, a crash of the host loses the hits
+# queued since the last flush.
+REGISTRY_HIT_WRITE_BEHIND = True
+REGISTRY_HIT_BATCH_SIZE = 500
+REGISTRY_HIT_FLUSH_INTERVAL = 5
+REGISTRY_HIT_SPOOL_DIR = os.path.join(
+    os.path.dirname(__file__), '..', 'spool').replace('\\', '/')
+
+# The current release (registry Version) is re-read at most every
+# REGISTRY_VERSION_TIMEOUT seconds by every worker, a saved Version is
+# only reloaded straight away by the worker which saved it
+REGISTRY_VERSION_TIMEOUT = 300
+REGISTRY_VERSION_CACHE_SIZE = 5000
+
+# How registry hits store the request headers: 'compact' keeps only
+# REGISTRY_HIT_HEADER_NAMES in a shared registry_hitheader row, 'full' the
+# whole str(request.META), None nothing.
+REGISTRY_HIT_HEADERS = 'compact'
+REGISTRY_HIT_HEADER_NAMES = (
+    'HTTP_USER_AGENT',
+    'HTTP_ACCEPT',
+    'HTTP_ACCEPT_ENCODING',
+    'HTTP_ACCEPT_LANGUAGE',
+    'HTTP_CONNECTION',
+    'HTTP_VIA',
+    'SERVER_PROTOCOL',
+)
+REGISTRY_HIT_HEADER_CACHE_SIZE = 1000
+
+# Agents whose hits are only logged once a day per address
+REGISTRY_DAILY_DEDUP_AGENTS = ('OMERO.web',)
+
+# Registry agents are re-read at most every REGISTRY_AGENT_TIMEOUT seconds
+REGISTRY_AGENT_TIMEOUT = 300
+
+# The registry statistics read daily rollups of the hits, brought up to
+# date at most every REGISTRY_ROLLUP_INTERVAL seconds when a report is
+# computed. Run "python manage.py rollup_hits" from cron to keep them
+# current, and with --rebuild once to backfill the existing hits.
+REGISTRY_ROLLUP_INTERVAL = 60
+
+# The registry statistics pages are cached for REGISTRY_STATISTICS_TIMEOUT
+# seconds. The per address counts only fold in the hits added since the
+# previous report and are recounted every REGISTRY_STATISTICS_RECOUNT seconds.
+# The last REGISTRY_STATISTICS_RECOUNT_WINDOW hit ids are recounted on every
+# report whose hits changed, to catch the batches of the workers committed
+# out of id order; keep it above REGISTRY_HIT_BATCH_SIZE x workers.
+REGISTRY_STATISTICS_TIMEOUT = 60
+REGISTRY_STATISTICS_RECOUNT = 86400
+REGISTRY_STATISTICS_RECOUNT_WINDOW = 10000
+
+# The geojson marker feed clusters the addresses when given a zoom level,
+# up to REGISTRY_CLUSTER_MAX_ZOOM. The clusters of every zoom level are
+# built with the markers below and kept in the markers cache, a worker reads
+# them again every REGISTRY_CLUSTER_TIMEOUT seconds.
+REGISTRY_CLUSTER_MAX_ZOOM = 12
+REGISTRY_CLUSTER_TIMEOUT = 600
+
+# The map markers of every continent and agent are rebuilt by
+# "python manage.py warm_markers" from cron, or with REGISTRY_MARKER_WARMER
+# by a thread in every worker every REGISTRY_MARKER_WARM_INTERVAL seconds
+# (less than CACHE_TIMEOUT). A new address has the continents containing
+# it rebuilt by the thread within REGISTRY_MARKER_REBUILD_DELAY seconds, by
+# one worker at a time; the whole map at most every
+# REGISTRY_MARKER_WORLD_DELAY seconds.
+REGISTRY_MARKER_WARMER = True
+REGISTRY_MARKER_WARM_INTERVAL = 1800
+REGISTRY_MARKER_REBUILD_DELAY = 10
+REGISTRY_MARKER_WORLD_DELAY = 300
+
+# Rendered charts are kept for REGISTRY_CHART_TIMEOUT seconds, a chart is
+# only rendered again when its data changes.
+REGISTRY_CHART_TIMEOUT = 86400
+
+# Number of test files per format and of test results, recounted every
+# REGISTRY_FILE_STAT_TIMEOUT seconds
+REGISTRY_FILE_STAT_TIMEOUT = 60
+
+# The demo server statistics borrow one of at most REGISTRY_DEMO_SESSIONS
+# OMERO sessions per worker to DEMO_SERVER, waiting REGISTRY_DEMO_WAIT
+# seconds at most. The idle sessions are pinged every
+# REGISTRY_DEMO_KEEPALIVE seconds and reopened when found dead.
+REGISTRY_DEMO_SESSIONS = 2
+REGISTRY_DEMO_KEEPALIVE = 60
+REGISTRY_DEMO_WAIT = 10
+
+# The demo server statistics are recomputed every
+# REGISTRY_DEMO_STATISTICS_TIMEOUT seconds
+REGISTRY_DEMO_STATISTICS_TIMEOUT = 600